@@ -1,3 +1,8 @@
 from .autodiff import AD
+from .adarray import ADArray
+from . import data
 from . import optimize
-from . import loss_function
\ No newline at end of file
+from . import loss_function
+from . import reverse
+from . import trace
+from . import hessian
@@ -0,0 +1,749 @@
+"""
+Array-backed automatic differentiation: ADArray
+"""
+
+__all__ = ['ADArray']
+
+import numpy as np
+from scipy import sparse as _sparse
+
+from boomdiff.autodiff import AD, _ELEMENTARY, _NO_GRAD, _expit
+from boomdiff.registry import Partials
+from boomdiff.reduction import value_and_weights
+
+
+class ADArray():
+    """
+    An array of forward mode AD values, stored as one contiguous float64 value
+    array plus a dense derivative array.
+
+    The derivative array has the shape of the values with one trailing axis
+    for the variables, i.e. der[..., k] holds the partial derivatives of every
+    element with respect to names[k]. All arithmetic, broadcasting, reductions
+    and matrix products are done with whole-array NumPy operations, instead of
+    one AD instance (and one partial dictionary) per element.
+
+    Indexing a single element, or reducing over all axes, returns a regular
+    AD instance, so results can be used with the optimizers directly.
+
+    For large models where each element only depends on a few variables, pass
+    sparse=True to from_array / from_ad: the derivatives are then stored as a
+    scipy.sparse CSR matrix of shape (size, number of variables), one row per
+    element in C order, and jacobian() returns that sparse matrix. Sparse mode
+    supports arrays of up to two dimensions.
+
+    Usage:
+    >>> w = ADArray.from_array(np.array([1., 2.]), 'w')
+    >>> X = np.array([[1., 0.], [3., 4.]])
+    >>> y = X @ w
+    >>> print(y.func_val)
+    [ 1. 11.]
+    >>> print(y[1])
+    11.0 ({'w_0': 3.0, 'w_1': 4.0})
+    >>> print(AD.sum(w**2))
+    5.0 ({'w_0': 2.0, 'w_1': 4.0})
+    >>> print(np.sum(np.log(w)).round(12))
+    0.69314718056 ({'w_0': 1.0, 'w_1': 0.5})
+    """
+
+    # NumPy dispatch protocols: ufuncs (np.sin(w), and operators with an
+    # ndarray on the left such as X @ w or y - w) and functions (np.sum,
+    # np.dot, ...) on ADArray operands run the vectorized methods below,
+    # see _UFUNCS and _FUNCTIONS at the end of this module
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        handler = _UFUNCS.get(ufunc)
+        if (method != '__call__') or kwargs or (handler is None):
+            return NotImplemented
+        return handler(*inputs)
+
+    def __array_function__(self, func, types, args, kwargs):
+        handler = _FUNCTIONS.get(func)
+        if handler is None:
+            # NumPy then raises a TypeError; convert explicitly with
+            # to_objects() to apply other functions to the AD instances
+            return NotImplemented
+        return handler(*args, **kwargs)
+
+    def __init__(self, func_val, der, names):
+        """
+        Parameters
+        ----------
+        func_val: array_like
+            Values of the elements, converted to a float64 array
+        der: array_like or scipy.sparse matrix
+            Derivatives, shape func_val.shape + (len(names),), or a sparse
+            matrix of shape (func_val.size, len(names))
+        names: list of str
+            Variable names of the trailing derivative axis
+        """
+        self.func_val = np.ascontiguousarray(func_val, dtype=float)
+        self.names = list(names)
+        if _sparse.issparse(der):
+            self.der = _sparse.csr_matrix(der, dtype=float)
+            assert self.der.shape == (self.func_val.size, len(self.names)), \
+                "sparse der should have shape (func_val.size, number of names)!"
+        else:
+            self.der = np.asarray(der, dtype=float)
+            assert self.der.shape == self.func_val.shape + (len(self.names),), \
+                "der should have shape func_val.shape + (number of names,)!"
+
+    @classmethod
+    def _new(cls, func_val, der, names):
+        # Trusted constructor used by operations, skips conversion and checks
+        if (AD._tape is _NO_GRAD) and names:
+            # Values only (see AD.no_grad): later operations carry no derivatives
+            der = _sparse.csr_matrix((func_val.size, 0)) if _sparse.issparse(der) else np.zeros(func_val.shape + (0,))
+            names = []
+        obj = cls.__new__(cls)
+        obj.func_val = func_val
+        obj.der = der
+        obj.names = names
+        return obj
+
+    @staticmethod
+    def from_array(array, prefix='x', sparse=False):
+        """
+        Create an ADArray of independent variables from a numpy array or list
+
+        Parameters
+        ----------
+        array: numpy array or list of int or float values
+
+        prefix: string
+            Used for the variable names. Elements on ith row, jth column will
+            have the name prefix_i_j, consistent with AD.from_array
+
+        sparse: bool, default False
+            Store the derivatives as a scipy.sparse CSR matrix
+
+        Examples
+        --------
+        >>> w = ADArray.from_array([[3.0, 2.4], [1.5, 3.3]], 'w')
+        >>> w.shape
+        (2, 2)
+        >>> w.name()
+        ['w_0_0', 'w_0_1', 'w_1_0', 'w_1_1']
+        >>> ADArray.from_array([1.0, 2.0], 'v', sparse=True).jacobian().nnz
+        2
+        """
+        assert isinstance(array, (list, np.ndarray)), "array should be a numpy array or list!"
+        assert isinstance(prefix, str), "prefix should be a string!"
+        value = np.array(array, dtype=float)
+
+        names = [prefix + ''.join(f"_{i}" for i in idx) for idx in np.ndindex(value.shape)]
+        if sparse:
+            assert value.ndim <= 2, "sparse ADArray supports up to two dimensions!"
+            return ADArray._new(value, _sparse.identity(value.size, format='csr'), names)
+        der = np.eye(value.size).reshape(value.shape + (value.size,))
+        return ADArray._new(value, der, names)
+
+    @staticmethod
+    def from_ad(AD_array, sparse=False):
+        """
+        Pack an AD instance, or a list/array of AD instances (for example the
+        output of AD.from_array), into an ADArray
+
+        With sparse=True the derivatives are stored as a CSR matrix holding
+        only the partial derivatives present in each element. Elements backed
+        by Partials (see AD.from_array(..., indexed=True)) are packed directly
+        from their slot arrays.
+
+        Examples
+        --------
+        >>> a = AD(1.0, 'a')
+        >>> b = AD(2.0, {'a': 3.0, 'b': 1.0})
+        >>> p = ADArray.from_ad([a, b])
+        >>> p.name()
+        ['a', 'b']
+        >>> print(p.der)
+        [[1. 0.]
+         [3. 1.]]
+        >>> print(ADArray.from_ad([a, b], sparse=True).jacobian().toarray())
+        [[1. 0.]
+         [3. 1.]]
+        """
+        if isinstance(AD_array, AD):
+            return ADArray._new(np.array(float(AD_array.func_val)),
+                                np.array(list(AD_array.partial_dict.values()), dtype=float),
+                                list(AD_array.partial_dict.keys()))
+
+        assert isinstance(AD_array, (list, np.ndarray)), "AD_array should be a numpy array or list!"
+        AD_array_arr = np.array(AD_array, dtype=object)
+        if sparse:
+            return ADArray._from_ad_sparse(AD_array_arr)
+        value = np.zeros(AD_array_arr.shape)
+        slots = {}
+        entries = []
+        for idx, x in np.ndenumerate(AD_array_arr):
+            if not isinstance(x, AD):
+                raise AttributeError("All elements in AD_array should be AD instances!")
+            value[idx] = x.func_val
+            for key, val in x.partial_dict.items():
+                entries.append((idx, slots.setdefault(key, len(slots)), val))
+
+        der = np.zeros(value.shape + (len(slots),))
+        for idx, k, val in entries:
+            der[idx + (k,)] += val
+        return ADArray._new(value, der, list(slots))
+
+    @staticmethod
+    def _from_ad_sparse(AD_array_arr):
+        assert AD_array_arr.ndim <= 2, "sparse ADArray supports up to two dimensions!"
+        objs = AD_array_arr.ravel()
+        for x in objs:
+            if not isinstance(x, AD):
+                raise AttributeError("All elements in AD_array should be AD instances!")
+        value = np.array([x.func_val for x in objs], dtype=float).reshape(AD_array_arr.shape)
+        counts = np.array([len(x.partial_dict) for x in objs], dtype=np.int64)
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+
+        partials = [x.partial_dict for x in objs]
+        registries = {p.registry for p in partials if isinstance(p, Partials)}
+        if len(registries) == 1 and all(isinstance(p, Partials) for p in partials):
+            # Registry slots are already integers: map them to columns at once
+            registry = registries.pop()
+            slots = np.concatenate([p.idx for p in partials] + [np.zeros(0, dtype=np.int64)])
+            data = np.concatenate([p.val for p in partials] + [np.zeros(0)])
+            used, indices = np.unique(slots, return_inverse=True)
+            names = registry.names(used)
+        else:
+            columns = {}
+            indices = np.fromiter((columns.setdefault(key, len(columns)) for p in partials for key in p.keys()),
+                                  dtype=np.int64, count=indptr[-1])
+            data = np.fromiter((val for p in partials for val in p.values()), dtype=float, count=indptr[-1])
+            names = list(columns)
+
+        der = _sparse.csr_matrix((data, indices, indptr), shape=(len(objs), len(names)))
+        der.sum_duplicates()
+        return ADArray._new(value, der, names)
+
+    @staticmethod
+    def _seeds(value, start, stop):
+        """ADArray at value seeded with the input directions start ... stop-1,
+        i.e. the identity columns of the flattened elements in that range"""
+        columns = np.arange(start, stop)
+        der = np.zeros((value.size, len(columns)))
+        der[columns, np.arange(len(columns))] = 1.
+        names = [f'_seed_{j}' for j in columns]
+        return ADArray._new(value, der.reshape(value.shape + (len(columns),)), names)
+
+    @staticmethod
+    def _tangents(result, names):
+        """Derivatives of result with respect to names, one row per element of
+        result in C order. result may be an AD instance, an ADArray, or a
+        list/array of AD instances and constants."""
+        if isinstance(result, ADArray):
+            jac = result.jacobian()
+            if result.is_sparse:
+                jac = jac.toarray()
+            if result.names == names:
+                return jac
+            out = np.zeros((result.size, len(names)))
+            columns = {name: k for k, name in enumerate(result.names)}
+            for k, name in enumerate(names):
+                if name in columns:
+                    out[:, k] = jac[:, columns[name]]
+            return out
+
+        elements = np.array([result] if isinstance(result, AD) else result, dtype=object).ravel()
+        out = np.zeros((len(elements), len(names)))
+        for i, y in enumerate(elements):
+            # Constants have a zero row
+            if isinstance(y, AD):
+                out[i] = [y.partial_dict.get(name, 0.) for name in names]
+        return out
+
+    def to_array(self):
+        """Return a copy of the function values as a numpy array"""
+        return self.func_val.copy()
+
+    def to_objects(self):
+        """Convert to a numpy object array of AD instances, the same layout as
+        the output of AD.from_array"""
+        AD_array = np.zeros(self.shape, dtype=AD)
+        for idx in np.ndindex(self.shape):
+            AD_array[idx] = self[idx]
+        return AD_array
+
+    def name(self):
+        """Return the variable name string list of the array"""
+        return list(self.names)
+
+    def value(self):
+        """Return the function values of the array"""
+        return self.func_val
+
+    def jacobian(self):
+        """Return the derivatives as a (number of elements) x (number of
+        variables) matrix, columns ordered as name(). In sparse mode this is
+        a scipy.sparse CSR matrix."""
+        if self.is_sparse:
+            return self.der.copy()
+        return self.der.reshape(self.size, len(self.names))
+
+    @property
+    def is_sparse(self):
+        """Whether the derivatives are stored as a sparse matrix"""
+        return _sparse.issparse(self.der)
+
+    @property
+    def shape(self):
+        return self.func_val.shape
+
+    @property
+    def ndim(self):
+        return self.func_val.ndim
+
+    @property
+    def size(self):
+        return self.func_val.size
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def transpose(self):
+        """Reverse the element axes; the variable axis stays last"""
+        if self.is_sparse:
+            return ADArray._new(self.func_val.T, self.der[self._rows().T.ravel()], self.names)
+        axes = tuple(range(self.ndim - 1, -1, -1)) + (self.ndim,)
+        return ADArray._new(self.func_val.T, self.der.transpose(axes), self.names)
+
+    def reshape(self, *shape):
+        """Return an ADArray with the same data and a new element shape"""
+        if len(shape) == 1 and isinstance(shape[0], (tuple, list)):
+            shape = tuple(shape[0])
+        value = self.func_val.reshape(shape)
+        if self.is_sparse:
+            # Rows are in C order, so the derivative matrix is unchanged
+            assert value.ndim <= 2, "sparse ADArray supports up to two dimensions!"
+            return ADArray._new(value, self.der, self.names)
+        return ADArray._new(value, self.der.reshape(value.shape + (len(self.names),)), self.names)
+
+    def __len__(self):
+        return len(self.func_val)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, idx):
+        value = self.func_val[idx]
+        if self.is_sparse:
+            return ADArray._wrap(value, self.der[np.ravel(self._rows()[idx])], self.names)
+        der = self.der[idx]
+        if np.ndim(value) == 0:
+            return AD._new(float(value), dict(zip(self.names, der.tolist())))
+        return ADArray._new(value, der, self.names)
+
+    def __repr__(self):
+        return f'ADArray({self.func_val}, names={self.names})'
+
+    # Operand handling
+    @staticmethod
+    def _coerce(other):
+        """Return other as an ADArray if it carries derivatives, otherwise as
+        a constant float array"""
+        if isinstance(other, ADArray):
+            return other
+        if isinstance(other, AD):
+            return ADArray.from_ad(other)
+        other_arr = np.asarray(other)
+        if other_arr.dtype == object:
+            return ADArray.from_ad(other_arr)
+        return other_arr.astype(float, copy=False)
+
+    @staticmethod
+    def _align(a, b):
+        """Express the derivatives of a and b over a common list of names.
+        If either one is sparse, both are returned as sparse matrices."""
+        if a.is_sparse or b.is_sparse:
+            return ADArray._align_sparse(a, b)
+        if a.names is b.names or a.names == b.names:
+            return a.der, b.der, a.names
+        slots = {name: k for k, name in enumerate(a.names)}
+        for name in b.names:
+            slots.setdefault(name, len(slots))
+        names = list(slots)
+
+        der_a = np.zeros(a.shape + (len(names),))
+        der_a[..., :len(a.names)] = a.der
+        der_b = np.zeros(b.shape + (len(names),))
+        der_b[..., [slots[name] for name in b.names]] = b.der
+        return der_a, der_b, names
+
+    @staticmethod
+    def _align_sparse(a, b):
+        der_a = _sparse.csr_matrix(a.jacobian())
+        der_b = _sparse.csr_matrix(b.jacobian())
+        if a.names is b.names or a.names == b.names:
+            return der_a, der_b, a.names
+        slots = {name: k for k, name in enumerate(a.names)}
+        for name in b.names:
+            slots.setdefault(name, len(slots))
+        names = list(slots)
+        columns = np.array([slots[name] for name in b.names], dtype=np.int64)
+
+        der_a = _sparse.csr_matrix((der_a.data, der_a.indices, der_a.indptr), shape=(a.size, len(names)))
+        der_b = _sparse.csr_matrix((der_b.data, columns[der_b.indices], der_b.indptr), shape=(b.size, len(names)))
+        return der_a, der_b, names
+
+    # Sparse mode helpers: the derivative row of element idx is _rows()[idx]
+    def _rows(self):
+        return np.arange(self.size).reshape(self.shape)
+
+    def _broadcast_der(self, shape):
+        """Sparse derivative rows of self broadcast to an element shape"""
+        if shape == self.shape:
+            return self.der
+        return self.der[np.broadcast_to(self._rows(), shape).ravel()]
+
+    @staticmethod
+    def _scale_rows(der, factor):
+        """Multiply each row of a CSR matrix by the matching entry of factor"""
+        factor = np.broadcast_to(np.asarray(factor, dtype=float).ravel(), (der.shape[0],))
+        return _sparse.csr_matrix((der.data * np.repeat(factor, np.diff(der.indptr)), der.indices, der.indptr),
+                                  shape=der.shape)
+
+    def _chain(self, value, factor):
+        # Elementwise chain rule: d(f(x)) = f'(x) * dx, broadcast to value
+        if self.is_sparse:
+            value = np.asarray(value)
+            der = self._broadcast_der(value.shape)
+            return ADArray._new(value, ADArray._scale_rows(der, np.broadcast_to(factor, value.shape)), self.names)
+        der = self.der * np.asarray(factor)[..., None]
+        if der.shape[:-1] != value.shape:
+            der = np.broadcast_to(der, value.shape + der.shape[-1:]).copy()
+        return ADArray._new(value, der, self.names)
+
+    def _binary(self, other, value_fn, dself_fn, dother_fn):
+        """Elementwise binary operation from its value and the two partial
+        derivatives, each given as a function of the operand values"""
+        other = ADArray._coerce(other)
+        if not isinstance(other, ADArray):
+            value = value_fn(self.func_val, other)
+            return self._chain(value, dself_fn(self.func_val, other))
+
+        value = value_fn(self.func_val, other.func_val)
+        der_a, der_b, names = ADArray._align(self, other)
+        if _sparse.issparse(der_a):
+            a = ADArray._new(self.func_val, der_a, names)._broadcast_der(value.shape)
+            b = ADArray._new(other.func_val, der_b, names)._broadcast_der(value.shape)
+            der = ADArray._scale_rows(a, np.broadcast_to(dself_fn(self.func_val, other.func_val), value.shape)) + \
+                  ADArray._scale_rows(b, np.broadcast_to(dother_fn(self.func_val, other.func_val), value.shape))
+            return ADArray._new(value, der.tocsr(), names)
+        der = der_a * np.asarray(dself_fn(self.func_val, other.func_val))[..., None] + \
+              der_b * np.asarray(dother_fn(self.func_val, other.func_val))[..., None]
+        if der.shape[:-1] != value.shape:
+            der = np.broadcast_to(der, value.shape + der.shape[-1:]).copy()
+        return ADArray._new(value, der, names)
+
+    # Overloaded operations
+    def __add__(self, other):
+        return self._binary(other, np.add, lambda a, b: 1., lambda a, b: 1.)
+
+    def __radd__(self, other):
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        return self._binary(other, np.subtract, lambda a, b: 1., lambda a, b: -1.)
+
+    def __rsub__(self, other):
+        return (-self).__add__(other)
+
+    def __mul__(self, other):
+        return self._binary(other, np.multiply, lambda a, b: b, lambda a, b: a)
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    def __truediv__(self, other):
+        return self._binary(other, np.divide, lambda a, b: 1/b, lambda a, b: -a/b**2)
+
+    def __rtruediv__(self, other):
+        other = ADArray._coerce(other)
+        if isinstance(other, ADArray):
+            return other.__truediv__(self)
+        value = other / self.func_val
+        return self._chain(value, -value / self.func_val)
+
+    def __pow__(self, other):
+        other = ADArray._coerce(other)
+        if not isinstance(other, ADArray):
+            return self._chain(self.func_val**other, other * self.func_val**(other - 1))
+        return self._binary(other, np.power,
+                            lambda a, b: b * a**(b - 1),
+                            lambda a, b: a**b * np.log(a))
+
+    def __rpow__(self, other):
+        other = ADArray._coerce(other)
+        if isinstance(other, ADArray):
+            return other.__pow__(self)
+        value = other**self.func_val
+        return self._chain(value, value * np.log(other))
+
+    def __neg__(self):
+        return ADArray._new(-self.func_val, -self.der, self.names)
+
+    def __matmul__(self, other):
+        other = ADArray._coerce(other)
+        if not isinstance(other, ADArray):
+            if self.is_sparse:
+                op = ADArray._sparse_matmul(self.shape, other)
+                return ADArray._wrap(self.func_val @ other, (op @ self.der).tocsr(), self.names)
+            return ADArray._new(self.func_val @ other, ADArray._der_matmul(self.der, other), self.names)
+        der_a, der_b, names = ADArray._align(self, other)
+        if _sparse.issparse(der_a):
+            der = ADArray._sparse_matmul(self.shape, other.func_val) @ der_a + \
+                  ADArray._sparse_rmatmul(self.func_val, other.shape) @ der_b
+            return ADArray._wrap(self.func_val @ other.func_val, der.tocsr(), names)
+        der = ADArray._der_matmul(der_a, other.func_val) + ADArray._der_rmatmul(self.func_val, der_b)
+        return ADArray._wrap(self.func_val @ other.func_val, der, names)
+
+    def __rmatmul__(self, other):
+        other = ADArray._coerce(other)
+        if isinstance(other, ADArray):
+            return other.__matmul__(self)
+        if self.is_sparse:
+            op = ADArray._sparse_rmatmul(other, self.shape)
+            return ADArray._wrap(other @ self.func_val, (op @ self.der).tocsr(), self.names)
+        return ADArray._wrap(other @ self.func_val, ADArray._der_rmatmul(other, self.der), self.names)
+
+    @staticmethod
+    def _sparse_matmul(shape, B):
+        # Matrix mapping the flattened dA to the flattened d(A @ B), constant B
+        B = np.asarray(B, dtype=float)
+        assert len(shape) <= 2 and B.ndim <= 2, "sparse ADArray supports up to two dimensions!"
+        m = shape[0] if len(shape) == 2 else 1
+        B2 = B.reshape(-1, 1) if B.ndim == 1 else B
+        return _sparse.kron(_sparse.identity(m), _sparse.csr_matrix(B2.T), format='csr')
+
+    @staticmethod
+    def _sparse_rmatmul(A, shape):
+        # Matrix mapping the flattened dB to the flattened d(A @ B), constant A
+        A = np.asarray(A, dtype=float)
+        assert len(shape) <= 2 and A.ndim <= 2, "sparse ADArray supports up to two dimensions!"
+        p = shape[1] if len(shape) == 2 else 1
+        A2 = A.reshape(1, -1) if A.ndim == 1 else A
+        return _sparse.kron(_sparse.csr_matrix(A2), _sparse.identity(p), format='csr')
+
+    @staticmethod
+    def _der_matmul(der, B):
+        # d(A @ B) for constant B: contract the last element axis of der with B
+        out = np.tensordot(der, B, axes=([der.ndim - 2], [0]))
+        return np.moveaxis(out, der.ndim - 2, -1)
+
+    @staticmethod
+    def _der_rmatmul(A, der):
+        # d(A @ B) for constant A: contract A with the first element axis of der
+        return np.tensordot(A, der, axes=([np.ndim(A) - 1], [0]))
+
+    @staticmethod
+    def _wrap(value, der, names):
+        """Return a 0-d result as an AD instance, otherwise as an ADArray"""
+        if np.ndim(value) == 0:
+            if _sparse.issparse(der):
+                # Only the stored partial derivatives of the single row
+                der = _sparse.csr_matrix(der)
+                der.sum_duplicates()
+                return AD._new(float(value), {names[k]: v for k, v in zip(der.indices.tolist(), der.data.tolist())})
+            return AD._new(float(value), dict(zip(names, np.asarray(der).tolist())))
+        return ADArray._new(np.asarray(value), der, names)
+
+    # Reductions
+    def _sum_der(self, axis):
+        """Derivatives of the sum of elements over axis (all if None)"""
+        if axis is None:
+            if self.is_sparse:
+                return _sparse.csr_matrix(self.der.sum(axis=0))
+            return self.der.reshape(-1, len(self.names)).sum(axis=0)
+        if self.is_sparse:
+            # Summation matrix: output element of each input element
+            shape = self.shape[:axis] + self.shape[axis + 1:]
+            out_rows = np.expand_dims(np.arange(int(np.prod(shape))).reshape(shape), axis)
+            rows = np.broadcast_to(out_rows, self.shape).ravel()
+            S = _sparse.csr_matrix((np.ones(self.size), (rows, np.arange(self.size))), shape=(out_rows.size, self.size))
+            return (S @ self.der).tocsr()
+        return self.der.sum(axis=axis)
+
+    def _check_axis(self, axis):
+        if axis is None:
+            return None
+        assert -self.ndim <= axis < self.ndim, "axis is out of bounds!"
+        return axis % self.ndim
+
+    def sum(self, axis=None):
+        """Sum of elements over a given axis, or over all elements if axis is
+        None (returns an AD instance)"""
+        axis = self._check_axis(axis)
+        return ADArray._wrap(self.func_val.sum(axis=axis), self._sum_der(axis), self.names)
+
+    def mean(self, axis=None):
+        """Average of elements over a given axis, or over all elements if axis
+        is None (returns an AD instance)"""
+        n = self.size if axis is None else self.shape[axis]
+        return self.sum(axis) * (1/n)
+
+    def _reduce(self, kind, axis):
+        # The derivative of a reduction is the sum of the element derivatives
+        # weighted by d value / d element, see reduction.value_and_weights
+        axis = self._check_axis(axis)
+        value, weights = value_and_weights(kind, self.func_val, axis)
+        return ADArray._wrap(value, self._chain(self.func_val, weights)._sum_der(axis), self.names)
+
+    def prod(self, axis=None):
+        """Product of elements over a given axis, or over all elements"""
+        return self._reduce('prod', axis)
+
+    def max(self, axis=None):
+        """Maximum over a given axis, or over all elements; the derivatives
+        are those of the (first) maximal element"""
+        return self._reduce('max', axis)
+
+    def min(self, axis=None):
+        """Minimum over a given axis, or over all elements; the derivatives
+        are those of the (first) minimal element"""
+        return self._reduce('min', axis)
+
+    def norm(self, axis=None):
+        """Euclidean norm over a given axis, or over all elements"""
+        return self._reduce('norm', axis)
+
+    def logsumexp(self, axis=None):
+        """log(sum(exp(self))) over a given axis, or over all elements,
+        computed without overflow"""
+        return self._reduce('logsumexp', axis)
+
+    def dot(self, other):
+        """Matrix product, equivalent to self @ other"""
+        return self.__matmul__(other)
+
+    # Elementwise functions, also reached through the AD static methods
+    def _elementary(self, name):
+        # Value and local derivative from the table shared with AD
+        value_fn, der_fn = _ELEMENTARY[name]
+        value = value_fn(self.func_val)
+        return self._chain(value, der_fn(self.func_val, value))
+
+    def sin(self):
+        return self._elementary('sin')
+
+    def cos(self):
+        return self._elementary('cos')
+
+    def tan(self):
+        return self._elementary('tan')
+
+    def arcsin(self):
+        return self._elementary('arcsin')
+
+    def arccos(self):
+        return self._elementary('arccos')
+
+    def arctan(self):
+        return self._elementary('arctan')
+
+    def sqrt(self):
+        return self._elementary('sqrt')
+
+    def log(self, base=np.e):
+        # Natural logarithm, divided by log(base) for other bases (see AD.log)
+        result = self._elementary('log')
+        return result if base == np.e else result / np.log(base)
+
+    def sinh(self):
+        return self._elementary('sinh')
+
+    def cosh(self):
+        return self._elementary('cosh')
+
+    def tanh(self):
+        return self._elementary('tanh')
+
+    def exp(self):
+        return self._elementary('exp')
+
+    def logistic(self, x_0=0, k=1, L=1):
+        value = L*_expit(k*(self.func_val - x_0))
+        return self._chain(value, k*value*(1 - value/L))
+
+    def log1p(self):
+        return self._elementary('log1p')
+
+    def expm1(self):
+        return self._elementary('expm1')
+
+    def softplus(self):
+        return self._elementary('softplus')
+
+    def log_sigmoid(self):
+        return self._elementary('log_sigmoid')
+
+    def bce_with_logits(self, targets):
+        """Elementwise binary cross-entropy with logits, see AD.bce_with_logits"""
+        targets = np.asarray(targets, dtype=float)
+        value = np.logaddexp(0., self.func_val) - targets*self.func_val
+        return self._chain(value, _expit(self.func_val) - targets)
+
+
+def _binary_ufunc(method, reflected):
+    # Binary ufunc with an ADArray on either side
+    def handler(a, b):
+        if isinstance(a, ADArray):
+            return method(a, b)
+        return reflected(b, a)
+    return handler
+
+_UFUNCS = {
+    np.add: _binary_ufunc(ADArray.__add__, ADArray.__radd__),
+    np.subtract: _binary_ufunc(ADArray.__sub__, ADArray.__rsub__),
+    np.multiply: _binary_ufunc(ADArray.__mul__, ADArray.__rmul__),
+    np.true_divide: _binary_ufunc(ADArray.__truediv__, ADArray.__rtruediv__),
+    np.power: _binary_ufunc(ADArray.__pow__, ADArray.__rpow__),
+    np.matmul: _binary_ufunc(ADArray.__matmul__, ADArray.__rmatmul__),
+    np.negative: ADArray.__neg__,
+    np.square: lambda x: x**2,
+    np.sin: ADArray.sin,
+    np.cos: ADArray.cos,
+    np.tan: ADArray.tan,
+    np.arcsin: ADArray.arcsin,
+    np.arccos: ADArray.arccos,
+    np.arctan: ADArray.arctan,
+    np.sqrt: ADArray.sqrt,
+    np.log: ADArray.log,
+    np.log2: lambda x: x.log(2),
+    np.log10: lambda x: x.log(10),
+    np.exp: ADArray.exp,
+    np.log1p: ADArray.log1p,
+    np.expm1: ADArray.expm1,
+    np.sinh: ADArray.sinh,
+    np.cosh: ADArray.cosh,
+    np.tanh: ADArray.tanh,
+}
+
+def _function(method, *params):
+    # Handler calling method(a, *params) for np.func(a, *params); other
+    # arguments (dtype, out, keepdims, ...) are not supported
+    def handler(a, *args, **kwargs):
+        if len(args) > len(params) or any(k not in params for k in kwargs):
+            return NotImplemented
+        values = dict(zip(params, args), **kwargs)
+        return method(ADArray._coerce(a), *(values.get(p) for p in params))
+    return handler
+
+_FUNCTIONS = {
+    np.sum: _function(ADArray.sum, 'axis'),
+    np.mean: _function(ADArray.mean, 'axis'),
+    np.prod: _function(ADArray.prod, 'axis'),
+    np.max: _function(ADArray.max, 'axis'),
+    np.amax: _function(ADArray.max, 'axis'),
+    np.min: _function(ADArray.min, 'axis'),
+    np.amin: _function(ADArray.min, 'axis'),
+    np.dot: _function(lambda a, b: a @ b, 'b'),
+    np.transpose: _function(lambda a, axes: a.transpose() if axes is None else NotImplemented, 'axes'),
+    np.reshape: _function(lambda a, newshape, order: a.reshape(newshape) if order in (None, 'C') else NotImplemented,
+                          'newshape', 'order'),
+    np.shape: _function(lambda a: a.shape),
+    np.ndim: _function(lambda a: a.ndim),
+    np.size: _function(lambda a, axis: a.size if axis is None else a.shape[axis], 'axis'),
+}
@@ -0,0 +1,182 @@
+"""
+Out-of-core datasets: memory-mapped .npy files read in blocks of rows
+"""
+
+__all__ = ['NpyDataset', 'csv_to_npy']
+
+import itertools
+import os
+
+import numpy as np
+
+from boomdiff.autodiff import AD
+
+
+class NpyDataset():
+    """
+    Inputs and outputs stored in .npy files, opened with np.load(...,
+    mmap_mode) so that only the rows in use are read into memory
+
+    Blocks of rows are views of the memory maps (no copies), and can be
+    passed to the functions of boomdiff.loss_function. blocks() reads the
+    file sequentially, or in a random order of blocks for stochastic steps;
+    loss() evaluates a mean loss over all rows one block at a time. Passed
+    as inputs to Optimizer.minimize, the dataset is trained on in mini-batch
+    mode. Peak memory is set by the block size, not by the number of rows.
+
+    Usage:
+    >>> import tempfile
+    >>> from boomdiff.loss_function import linear_mse
+    >>> folder = tempfile.mkdtemp()
+    >>> np.save(os.path.join(folder, 'X.npy'), np.array([[2., 3.], [5., 6.]]))
+    >>> np.save(os.path.join(folder, 'y.npy'), np.array([1., 4.]))
+    >>> data = NpyDataset(os.path.join(folder, 'X.npy'), os.path.join(folder, 'y.npy'))
+    >>> len(data)
+    2
+    >>> data.loss(linear_mse, [AD(0.0, 'v1'), AD(0.0, 'v2')], block_rows=1)
+    8.5 ({'v1': -22.0, 'v2': -27.0})
+    """
+
+    def __init__(self, inputs, outputs, mmap_mode='r'):
+        """
+        Parameters
+        ----------
+        inputs: path of a .npy file, or array (e.g. an np.memmap)
+            n observations (rows) by m features (columns)
+        outputs: path of a .npy file, or array
+            n outputs, ordered according to the rows of inputs
+        mmap_mode: str, default 'r'
+            Passed to np.load for paths
+        """
+        self.inputs = self._open(inputs, mmap_mode)
+        self.outputs = self._open(outputs, mmap_mode)
+        assert self.inputs.ndim == 2, 'inputs must be a 2-D array!'
+        if self.outputs.ndim == 2:
+            assert 1 in self.outputs.shape, 'Outputs cannot be multidimensional!'
+            self.outputs = self.outputs.reshape(-1)
+        assert self.outputs.ndim == 1, 'Outputs cannot have more than 2 dimensions!'
+        assert len(self.inputs) == len(self.outputs), 'Input and output must be of same dimension'
+
+    @staticmethod
+    def _open(source, mmap_mode):
+        if isinstance(source, (str, os.PathLike)):
+            return np.load(source, mmap_mode=mmap_mode)
+        return np.asarray(source)
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def blocks(self, block_rows, shuffle=False, seed=None):
+        """Iterate over (inputs, outputs) blocks of at most block_rows rows
+
+        Parameters
+        ----------
+        block_rows: positive int
+        shuffle: bool, default False
+            Visit the blocks in a random order (random block sampling)
+            instead of sequentially
+        seed: int or None
+            Seed of the random order
+
+        Yields
+        ------
+        views of the inputs and outputs rows of each block
+        """
+        assert isinstance(block_rows, (int, np.integer)) and (block_rows > 0), "block_rows should be positive int!"
+        starts = np.arange(0, len(self), block_rows)
+        if shuffle:
+            starts = np.random.default_rng(seed).permutation(starts)
+        for start in starts.tolist():
+            yield self.inputs[start:start + block_rows], self.outputs[start:start + block_rows]
+
+    def loss(self, loss, var_list, block_rows=65536):
+        """Mean loss over all rows, evaluated block by block in a sequential
+        pass
+
+        Parameters
+        ----------
+        loss: callable
+            loss(inputs, outputs, var_list) giving the mean loss over the rows
+            passed, such as boomdiff.loss_function.linear_mse
+        var_list: list/array of AD objects, or ADArray
+        block_rows: positive int, default 65536
+
+        Returns
+        -------
+        AD instance, the row-weighted average of the block losses
+        """
+        total = None
+        for inputs, outputs in self.blocks(block_rows):
+            part = loss(inputs, outputs, var_list) * (len(outputs) / len(self))
+            if total is None:
+                total = part
+            else:
+                total += part
+        return total
+
+
+def csv_to_npy(csv_path, inputs_path, outputs_path, output_column=-1, delimiter=',', skip_header=0,
+               chunk_rows=65536):
+    """Convert a numeric CSV file into an inputs and an outputs .npy file,
+    reading at most chunk_rows lines at a time
+
+    The file is read twice: once to count the rows and once to fill .npy
+    files created with np.lib.format.open_memmap.
+
+    Parameters
+    ----------
+    csv_path: path of the CSV file
+    inputs_path, outputs_path: paths of the .npy files to write
+    output_column: int, default -1
+        Column holding the outputs; every other column is an input
+    delimiter: str, default ','
+    skip_header: int, default 0
+        Number of lines to skip at the start of the file
+    chunk_rows: positive int, default 65536
+
+    Returns
+    -------
+    NpyDataset of the written files
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> with open(os.path.join(folder, 'data.csv'), 'w') as f:
+    ...     _ = f.write('a,b,y\\n2,3,1\\n5,6,4\\n')
+    >>> data = csv_to_npy(os.path.join(folder, 'data.csv'), os.path.join(folder, 'X.npy'),
+    ...                   os.path.join(folder, 'y.npy'), skip_header=1, chunk_rows=1)
+    >>> print(data.inputs, data.outputs)
+    [[2. 3.]
+     [5. 6.]] [1. 4.]
+    """
+    assert isinstance(chunk_rows, (int, np.integer)) and (chunk_rows > 0), "chunk_rows should be positive int!"
+
+    def data_lines(f):
+        # Lines after the header, without blank ones
+        return (line for line in itertools.islice(f, skip_header, None) if line.strip())
+
+    with open(csv_path) as f:
+        lines = data_lines(f)
+        first = next(lines, None)
+        assert first is not None, "The CSV file has no data rows!"
+        n_columns = len(first.split(delimiter))
+        n_rows = 1 + sum(1 for _ in lines)
+    assert n_columns >= 2, "The CSV file needs at least one input and one output column!"
+    output_column = output_column % n_columns
+    input_columns = [j for j in range(n_columns) if j != output_column]
+
+    inputs = np.lib.format.open_memmap(inputs_path, mode='w+', dtype=float, shape=(n_rows, n_columns - 1))
+    outputs = np.lib.format.open_memmap(outputs_path, mode='w+', dtype=float, shape=(n_rows,))
+    with open(csv_path) as f:
+        lines = data_lines(f)
+        start = 0
+        while start < n_rows:
+            chunk = np.loadtxt(list(itertools.islice(lines, chunk_rows)), delimiter=delimiter, ndmin=2)
+            inputs[start:start + len(chunk)] = chunk[:, input_columns]
+            outputs[start:start + len(chunk)] = chunk[:, output_column]
+            start += len(chunk)
+    inputs.flush()
+    outputs.flush()
+    del inputs, outputs
+    return NpyDataset(inputs_path, outputs_path)
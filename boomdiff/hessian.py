@@ -0,0 +1,121 @@
+"""
+Second-order derivatives: Hessians and Hessian-vector products
+"""
+
+__all__ = ['hessian', 'hvp', 'hessian_operator']
+
+import numpy as np
+from scipy.sparse.linalg import LinearOperator
+
+from boomdiff.autodiff import AD
+from boomdiff.trace import Program, trace
+
+
+def _program_and_names(loss, var_list):
+    """Trace loss unless it is already a Program, and return the variable
+    names of var_list in order"""
+    program = loss if isinstance(loss, Program) else trace(loss)
+    assert isinstance(var_list, (np.ndarray, list)), "var_list should be a variable list or array!"
+    names = []
+    for var in var_list:
+        assert isinstance(var, AD), "Elements in var_list should be AD variables! Or make your var_list 1D!"
+        names.append(var.name()[0])
+    return program, names
+
+
+def hessian(loss, var_list):
+    """Dense Hessian of a loss at the current values of the variables
+
+    All columns are computed in one forward-over-reverse sweep of the traced
+    loss, so this is meant for problems with a moderate number of variables.
+
+    Parameters
+    ----------
+    loss: callable or boomdiff.trace.Program
+        takes no arguments and outputs an AD instance
+
+    var_list: 1D list/array of AD instances (variables)
+        rows and columns of the result follow this order
+
+    Returns
+    -------
+    numpy array of shape (len(var_list), len(var_list))
+
+    Examples
+    --------
+    >>> x = AD(1., 'x')
+    >>> y = AD(2., 'y')
+    >>> print(hessian(lambda: x**2 * y + 3*y, [x, y]))
+    [[4. 2.]
+     [2. 0.]]
+    """
+    program, names = _program_and_names(loss, var_list)
+    return program.hessian_product(names, np.eye(len(names)))[2]
+
+
+def hvp(loss, var_list, vector):
+    """Hessian-vector product of a loss at the current values of the
+    variables, at the cost of about two gradient evaluations
+
+    Parameters
+    ----------
+    loss: callable or boomdiff.trace.Program
+        takes no arguments and outputs an AD instance
+
+    var_list: 1D list/array of AD instances (variables)
+        order of the entries of vector and of the result
+
+    vector: array_like of length len(var_list)
+
+    Returns
+    -------
+    numpy array of length len(var_list)
+
+    Examples
+    --------
+    >>> x = AD(1., 'x')
+    >>> y = AD(2., 'y')
+    >>> print(hvp(lambda: x**2 * y + 3*y, [x, y], [1., -1.]))
+    [2. 2.]
+    """
+    program, names = _program_and_names(loss, var_list)
+    vector = np.asarray(vector, dtype=float)
+    assert vector.shape == (len(names),), "vector should have the same length as var_list!"
+    return program.hessian_product(names, vector.reshape(-1, 1))[2][:, 0]
+
+
+def hessian_operator(loss, var_list):
+    """Hessian of a loss as a scipy.sparse.linalg.LinearOperator, for use with
+    iterative solvers such as scipy.sparse.linalg.cg
+
+    The loss is traced once; each product is computed with hvp at the values
+    the variables have when the product is taken.
+
+    Parameters
+    ----------
+    loss: callable or boomdiff.trace.Program
+        takes no arguments and outputs an AD instance
+
+    var_list: 1D list/array of AD instances (variables)
+
+    Returns
+    -------
+    LinearOperator of shape (len(var_list), len(var_list))
+
+    Examples
+    --------
+    >>> x = AD(1., 'x')
+    >>> y = AD(2., 'y')
+    >>> H = hessian_operator(lambda: x**2 * y + 3*y, [x, y])
+    >>> print(H @ np.array([0., 1.]))
+    [2. 0.]
+    """
+    program, names = _program_and_names(loss, var_list)
+
+    def matmat(directions):
+        return program.hessian_product(names, directions)[2]
+
+    n = len(names)
+    return LinearOperator((n, n), matvec=lambda v: matmat(np.reshape(v, (n, 1)))[:, 0],
+                          rmatvec=lambda v: matmat(np.reshape(v, (n, 1)))[:, 0],
+                          matmat=matmat, dtype=float)
@@ -1,5 +1,6 @@
 import numpy as np
-from boomdiff.autodiff import AD
+from boomdiff.autodiff import AD, _NO_GRAD, _expit
+from boomdiff.adarray import ADArray
 
 """Defines a series of loss functions to be called in various use-case
 methods"""
@@ -20,11 +21,65 @@ def _rowsums(data, var_list):
     
     Returns
     -------
-    length n array representing rows of data matrix as AD objects
+    length n array representing rows of data matrix as AD objects; an ADArray
+    when computed with the AD.dot fast path
     """
-    return AD.sum(data * np.array(var_list).reshape(1,-1), axis=1)
+    return AD.dot(data, np.array(var_list).reshape(-1))
 
-def linear_mse(inputs, outputs, var_list):
+def _packed_params(var_list):
+    """Pack var_list into an ADArray for the closed-form losses, or return
+    None when the composed AD operations are needed instead: while a trace
+    records the elementwise operations, or for constants and batched values
+    in var_list"""
+    if isinstance(var_list, ADArray):
+        return None if getattr(AD._tape, 'elementwise', False) else var_list.reshape(-1)
+    params = np.array(var_list, dtype=object).reshape(-1)
+    if getattr(AD._tape, 'elementwise', False) or not AD._packable(params):
+        return None
+    return ADArray.from_ad(params)
+
+def _closed_form(value, gradient, params):
+    """AD result of a loss with the given value, whose gradient with respect
+    to params is returned by the callable gradient, chained to the variables
+    params depend on. The gradient is not computed in AD.no_grad mode."""
+    if AD._tape is _NO_GRAD:
+        return AD._new(value, {})
+    grad = gradient()
+    der = params.der
+    ders = der.T @ grad if not isinstance(der, np.ndarray) else grad @ der
+    return AD._new(value, dict(zip(params.names, ders.tolist())))
+
+def _row_chunks(n, chunk_rows):
+    """Slices of consecutive rows, chunk_rows at a time (all rows if None)"""
+    assert (chunk_rows is None) or (isinstance(chunk_rows, (int, np.integer)) and chunk_rows > 0), \
+        'chunk_rows should be None or a positive int!'
+    step = max(n, 1) if chunk_rows is None else chunk_rows
+    return [slice(start, start + step) for start in range(0, n, step)]
+
+def _accumulate_terms(kind, inputs, outputs, beta, chunk_rows, with_xtr=True):
+    """One pass over chunks of rows of the closed-form losses
+
+    Returns the sum over all rows of the loss terms, (X beta - y)**2 for
+    kind 'mse' or softplus(X beta) - y * X beta for kind 'bce', and X^T r
+    for the residuals r = X beta - y, respectively logistic(X beta) - y.
+    X^T r is None in AD.no_grad mode, or if with_xtr is False. Temporary
+    arrays hold at most chunk_rows rows."""
+    total = 0.
+    xtr = None if (AD._tape is _NO_GRAD or not with_xtr) else np.zeros(inputs.shape[1])
+    for rows in _row_chunks(len(outputs), chunk_rows):
+        x, y = inputs[rows], outputs[rows]
+        z = x @ beta
+        if kind == 'mse':
+            residuals = z - y
+            total += residuals @ residuals
+        else:
+            total += np.sum(np.logaddexp(0., z) - y * z)
+            residuals = None if xtr is None else _expit(z) - y
+        if xtr is not None:
+            xtr += residuals @ x
+    return total, xtr
+
+def linear_mse(inputs, outputs, var_list, chunk_rows=None):
     """Calculates mean squared error for AD objects. All objects passed to var_list
     must be instantiated AD objects. Highly preferable for data to be input as numpy
     array with observations as rows and features as columns.
@@ -39,6 +94,10 @@ def linear_mse(inputs, outputs, var_list):
         list of AD objects to be included in function
     outputs:
         index of outcome in data
+    chunk_rows: positive int or None, default None
+        Walk the rows in chunks of this size, accumulating the loss and its
+        gradient, so that temporary arrays hold at most chunk_rows rows. The
+        result equals that of None (all rows at once) up to rounding.
     
     Examples
     --------
@@ -53,10 +112,10 @@ def linear_mse(inputs, outputs, var_list):
 
     # Step 1: Convert data to array format and confirm it is 2-dimensional
     # If not, could be converted by np.reshape(n,p) to get to n x p matrix
-    inputs = np.array(inputs)
+    inputs = np.asarray(inputs)
     assert inputs.ndim == 2, 'data must be convertible to 2-D array!'        
 	
-    outputs = np.array(outputs)
+    outputs = np.asarray(outputs)
     if outputs.ndim == 2:
         assert (outputs.shape[1] == 1) or (outputs.shape[0] == 1), 'Outputs cannot be multidimensional!'
     else:
@@ -64,16 +123,25 @@ def linear_mse(inputs, outputs, var_list):
  
     # Step 1A: Check that size of data are compatible
     outputs = outputs.reshape(-1)
-    assert _rowsums(inputs, var_list).shape[0] == outputs.shape[0], 'Input and output must be of same dimension'
-    
+    assert inputs.shape[0] == outputs.shape[0], 'Input and output must be of same dimension'
+
+    # Step 2: Closed form: the value from the residuals X beta - y, and the
+    # gradient 2/n X^T (X beta - y), with two matrix-vector products
+    params = _packed_params(var_list)
+    if params is not None:
+        assert inputs.shape[1] == params.size, 'var_list must have one variable per input column'
+        sse, xtr = _accumulate_terms('mse', inputs, outputs, params.func_val, chunk_rows)
+        return _closed_form(sse / len(outputs), lambda: 2 / len(outputs) * xtr, params)
+
     # Step 3: Calculate loss function - _rowsums() method can be used to
-    # make x, beta to x*beta step
-    sse = AD.sum((outputs - _rowsums(inputs, var_list)) ** 2)
+    # make x, beta to x*beta step, one chunk of rows at a time
+    sse = AD.sum([AD.sum((outputs[rows] - _rowsums(inputs[rows], var_list)) ** 2)
+                  for rows in _row_chunks(len(outputs), chunk_rows)])
     # Note: Linear MSE could be calculated in one step
     return (1/len(outputs))*sse
 
 
-def logistic_cross_entropy(inputs, outputs, var_list):
+def logistic_cross_entropy(inputs, outputs, var_list, chunk_rows=None):
     """Calculates the binary cross-entropy between true_label and predictions
     
     Parameters
@@ -86,6 +154,10 @@ def logistic_cross_entropy(inputs, outputs, var_list):
         list of AD objects to be included in function
     outputs:
         index of outcome in data
+    chunk_rows: positive int or None, default None
+        Walk the rows in chunks of this size, accumulating the loss and its
+        gradient, so that temporary arrays hold at most chunk_rows rows. The
+        result equals that of None (all rows at once) up to rounding.
      
     Returns
     -------
@@ -98,39 +170,149 @@ def logistic_cross_entropy(inputs, outputs, var_list):
     >>> v1 = AD(0.0, 'v1')
     >>> v2 = AD(0.0, 'v2')
     >>> varlist = [v1, v2]
-    >>> logistic_cross_entropy(x, y, varlist)
-    0.6931471805599453 ({'v1': 0.75, 'v2': 0.75})
+    >>> logistic_cross_entropy(x, y, varlist).round(12)
+    0.69314718056 ({'v1': 0.75, 'v2': 0.75})
     >>> assert type(logistic_cross_entropy(x, y, varlist)) == AD
     """
 
     # Step 1: Convert data to array format and confirm it is 2-dimensional
     # If not, could be converted by np.reshape(n,p) to get to n x p matrix
-    inputs = np.array(inputs)
+    inputs = np.asarray(inputs)
     assert inputs.ndim == 2, 'data must be convertible to 2-D array!'
 
     
     # Step 2A (optional): Validate data. Because this is a logistic regression
     # output, we check that all data is zero or one
-    outputs = np.array(outputs)
+    outputs = np.asarray(outputs)
     if outputs.ndim == 2:
         assert (outputs.shape[1] == 1) or (outputs.shape[0] == 1), 'Outputs cannot be multidimensional!'
     else:
         assert outputs.ndim == 1, 'Outputs cannot have more than 2 dimensions!'
     
-    for x in outputs:
-        assert x in [0, 1], 'All outcomes must be 0 or 1!'
+    assert np.all((outputs == 0) | (outputs == 1)), 'All outcomes must be 0 or 1!'
     outputs = outputs.reshape(-1)
-        
+    if inputs.shape[0] != outputs.shape[0]:
+        raise ValueError('Input and output must be of same dimension')
+
+    # Step 2B: Closed form: the value as the mean of softplus(z) - y*z for
+    # the row sums z = X beta, and the gradient 1/n X^T (logistic(z) - y)
+    params = _packed_params(var_list)
+    if params is not None:
+        assert inputs.shape[1] == params.size, 'var_list must have one variable per input column'
+        total, xtr = _accumulate_terms('bce', inputs, outputs, params.func_val, chunk_rows)
+        return _closed_form(total / len(outputs), lambda: xtr / len(outputs), params)
+
     # Step 3: Calculate loss function
-    # Note: Because this is a logistic cross_entropy function,
-    # we use AD.logisitc() to convert our linear row sums to probabilities
-    pred_probs = AD.logistic(_rowsums(inputs, var_list))
-    
-    # Note: Factors are calculated separately to present information cleanly,
-    # could be combined
-    log_probs = AD.log(pred_probs)
-    log_1_probs = AD.log(1 - pred_probs)
-    mf = -(1/len(outputs))
-    return mf*np.sum((outputs*log_probs) + (1 - outputs)*log_1_probs)
+    # Note: the cross-entropy of logistic(row sums) is computed from the row
+    # sums directly with the fused AD.bce_with_logits, which is stable when
+    # the predicted probabilities saturate at 0 or 1
+    if chunk_rows is None:
+        return AD.mean(AD.bce_with_logits(_rowsums(inputs, var_list), outputs))
+    return AD.sum([AD.sum(AD.bce_with_logits(_rowsums(inputs[rows], var_list), outputs[rows]))
+                   for rows in _row_chunks(len(outputs), chunk_rows)]) / len(outputs)
 
-    
+
+class Dataset():
+    """
+    Inputs and outputs of linear_mse or logistic_cross_entropy, validated
+    and converted once
+
+    The loss functions check and convert their data on every call, i.e. on
+    every optimizer step. A Dataset does this once, stores the inputs as a
+    contiguous float64 array and evaluates the loss by calling it with the
+    var_list. For 'linear_mse' it also precomputes X^T X and X^T y, so that
+    the gradient costs O(m**2) for m features, independent of the number of
+    rows. The value is still computed from the residuals X beta - y, and
+    equals that of linear_mse.
+
+    Usage:
+    >>> data = Dataset(np.array([[2, 3], [5, 6]]), np.array([1, 4]))
+    >>> v1 = AD(0.0, 'v1')
+    >>> v2 = AD(0.0, 'v2')
+    >>> data([v1, v2])
+    8.5 ({'v1': -22.0, 'v2': -27.0})
+    >>> # A loss callable for Optimizer.minimize
+    >>> loss = lambda: data([v1, v2])
+    """
+
+    LOSSES = ('linear_mse', 'logistic_cross_entropy')
+
+    def __init__(self, inputs, outputs, loss='linear_mse', order='C', chunk_rows=None):
+        """
+        Parameters
+        ----------
+        inputs: np.array
+            Input data, n observations (rows) by m features (columns)
+        outputs: np.array
+            Output data, ordered according to the rows of inputs; 0 or 1 for
+            'logistic_cross_entropy'
+        loss: str, one of Dataset.LOSSES, default 'linear_mse'
+        order: 'C' or 'F', default 'C'
+            Memory layout of the stored inputs. 'F' (column-major) makes the
+            products X^T r of the 'logistic_cross_entropy' gradient read the
+            data contiguously. The 'linear_mse' gradient uses the precomputed
+            X^T X and X^T y instead, and its residuals X beta read rows, so
+            'C' suits it best.
+        chunk_rows: positive int or None, default None
+            Rows per chunk when the loss walks the data (see linear_mse and
+            logistic_cross_entropy)
+        """
+        assert loss in Dataset.LOSSES, f"loss should be one of {Dataset.LOSSES}!"
+        assert order in ('C', 'F'), "order should be 'C' or 'F'!"
+        _row_chunks(0, chunk_rows)  # validates chunk_rows
+        inputs = np.array(inputs, dtype=float, order=order)
+        assert inputs.ndim == 2, 'data must be convertible to 2-D array!'
+
+        outputs = np.array(outputs, dtype=float)
+        if outputs.ndim == 2:
+            assert (outputs.shape[1] == 1) or (outputs.shape[0] == 1), 'Outputs cannot be multidimensional!'
+        else:
+            assert outputs.ndim == 1, 'Outputs cannot have more than 2 dimensions!'
+        outputs = np.ascontiguousarray(outputs.reshape(-1))
+
+        if loss == 'logistic_cross_entropy':
+            assert np.all((outputs == 0) | (outputs == 1)), 'All outcomes must be 0 or 1!'
+            if inputs.shape[0] != outputs.shape[0]:
+                raise ValueError('Input and output must be of same dimension')
+        else:
+            assert inputs.shape[0] == outputs.shape[0], 'Input and output must be of same dimension'
+
+        self.inputs = inputs
+        self.outputs = outputs
+        self.loss = loss
+        self.chunk_rows = chunk_rows
+        if loss == 'linear_mse':
+            self.xtx = inputs.T @ inputs
+            self.xty = outputs @ inputs
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def __call__(self, var_list):
+        """Value and gradient of the loss at var_list, as an AD instance
+
+        Parameters
+        ----------
+        var_list: list/array of AD objects, or ADArray
+            one per input column
+
+        Returns
+        -------
+        AD instance, equal to the loss function called on the data
+        """
+        params = _packed_params(var_list)
+        if params is None:
+            # Composed AD operations, e.g. while a trace is recording
+            loss = linear_mse if self.loss == 'linear_mse' else logistic_cross_entropy
+            return loss(self.inputs, self.outputs, var_list, self.chunk_rows)
+        assert self.inputs.shape[1] == params.size, 'var_list must have one variable per input column'
+        beta, n = params.func_val, len(self.outputs)
+
+        if self.loss == 'linear_mse':
+            # The value from the residuals, the gradient 2/n X^T (X beta - y)
+            # from the Gram terms
+            sse, _ = _accumulate_terms('mse', self.inputs, self.outputs, beta, self.chunk_rows, with_xtr=False)
+            return _closed_form(sse / n, lambda: 2 / n * (self.xtx @ beta - self.xty), params)
+
+        total, xtr = _accumulate_terms('bce', self.inputs, self.outputs, beta, self.chunk_rows)
+        return _closed_form(total / n, lambda: xtr / n, params)
@@ -4,8 +4,6 @@ Interface for Gradient Descent (GD)
 
 __all__ = ['GD']
 
-import warnings 
-
 import numpy as np
 
 from boomdiff.autodiff import AD
@@ -60,14 +58,7 @@ class GD(Optimizer):
 
         x_i = x_i - learning_rate * grad(loss(x_i))
         """
-        for var in var_list:
-            try:
-                grad = grad_dict[var.name()[0]]
-                #print("grad: ", grad)
-                if abs(grad) >  10**8:
-                    warnings.warn("Gradient is too large: potential numerical instability")
-                var.func_val -= self.lr * grad
-            except:
-                raise AttributeError("Var_list should be 1D, with AD instances as elements, which are variables in loss!")
-            #print("var.func_val: ", var.func_val)
+        _, values, grads = self._gather(var_list, grad_dict)
+        values -= self.lr * grads
+        self._scatter(var_list, values)
 
@@ -4,8 +4,6 @@ Interface for Momentum accelerated Gradient Descent
 
 __all__ = ['Momentum']
 
-import warnings
-
 import numpy as np
 
 from boomdiff.autodiff import AD
@@ -64,44 +62,12 @@ class Momentum(Optimizer):
         v_t = gamma * v_{t-1} + lr * gradient
         theta = theta - v_t
         """
-        if not hasattr(self,'last_update'):
-            # If no history before, initialize one empty dictionary
-            new_update_dict = {}
-            # for var in var_list:
-            #     try:
-            #         new_update_dict[var.name()[0]] = 0.
-            #     except:
-            #         raise AttributeError("Elements in var_list should be AD variables! Or make your var_list 1D!")
-            self.last_update = new_update_dict
-
-        assert isinstance(self.last_update, dict), "last update should be a dictionary!"
-
-        # new_update_dict = {}
-        for var in var_list:
-            try:
-                grad = grad_dict[var.name()[0]]
-                # Trivial numerical instability check
-                if abs(grad) > 10**8:
-                    warnings.warn("Gradient is too large: potential numerical instability")
-                
-                try: 
-                    v_tm1 = self.last_update[var.name()[0]]
-                except KeyError:
-                    self.last_update[var.name()[0]] = 0.
-                    v_tm1 = self.last_update[var.name()[0]]
-
-                v_t = self.gamma * v_tm1 + self.lr * grad
-                
-                # update the variable value
-                var.func_val -= v_t
-
-                # update the last_update dictionary
-                self.last_update[var.name()[0]] = v_t
-            except:
-                raise AttributeError("Var_list should be 1D, with AD instances as elements, which are variables in loss!")
-
-
-
+        positions, values, grads = self._gather(var_list, grad_dict)
+        v_tm1, = self._state(positions, 'last_update')
 
+        v_t = self.gamma * v_tm1 + self.lr * grads
 
-        
+        # update the variable values and the last_update array
+        values -= v_t
+        self._scatter(var_list, values)
+        self.last_update[positions] = v_t
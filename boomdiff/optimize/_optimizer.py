@@ -1,8 +1,15 @@
+import warnings
+
 import numpy as np
 
 import matplotlib.pyplot as plt
 
 from boomdiff.autodiff import AD
+from boomdiff.adarray import ADArray
+from boomdiff.data import NpyDataset
+from boomdiff.registry import Partials
+from boomdiff.reverse import value_and_grad
+from boomdiff.trace import trace
 
 
 class Optimizer():
@@ -14,6 +21,11 @@ class Optimizer():
     Contains step and minimize methods, while _apply_gradient is implemented by
     separately for different algorithms.
 
+    Updates are vectorized: _gather packs the values and gradients of var_list
+    into float arrays, optimizer state (moments) is kept in NumPy arrays with
+    one entry per variable name seen so far (see _state), and _scatter writes
+    the new values back.
+
     Check subclasses (such as gradient_descent) for usage examples
 
     Learning rate defines the size of the iteration steps. Default value is 0.1
@@ -26,8 +38,13 @@ class Optimizer():
 
         self.iterations = 0 # Record iteration number
         self.loss_track = [] #loss function value for each iteration
+        self.epoch_loss_track = [] #full-data loss before training and after each epoch (mini-batch mode)
+        self._program = None # Traced loss for mode='trace'
+        self._pending = False # Loss after the last recorded update not yet in loss_track
+        self._state_index = {} # Variable name -> position in the state arrays
+        self._layout = None # (names, positions) of the last var_list
 
-    def step(self, loss, var_list, learning_rate=None, record=False):
+    def step(self, loss, var_list, learning_rate=None, record=False, mode='forward'):
         """update the variables for one step, to minimize the loss value
 
         Parameters
@@ -35,21 +52,40 @@ class Optimizer():
         loss: callable
             objective function, takes no arguments and output an AD instance
 
-        var_list: 1D list/array of AD instances (variables)
+        var_list: 1D list/array of AD instances (variables), or ADArray
             the variable lists that you want to update. It can be part of the variables in loss callable.
+            Variables with requires_grad False are left unchanged. An ADArray of
+            variables (see ADArray.from_array) is updated in place as a whole.
 
         learning_rate: int or float
             You can also specify the learning rate here
 
         record: Bool, default False
-            Whether you want to append the current loss to class attribute loss_track. 
+            Whether you want to append the current loss to class attribute loss_track.
+            The loss after the update is evaluated in AD.no_grad mode, as a value only.
+
+        mode: 'forward', 'reverse' or 'trace', default 'forward'
+            How the gradient of loss is computed. 'reverse' records loss() on a
+            tape and runs one backward sweep, which is much cheaper when the
+            loss depends on many variables. 'trace' traces loss() once into a
+            boomdiff.trace.Program and replays it on later steps with the same
+            loss callable; call retrace() if the structure of the loss changes.
 
         Returns
         -------
         Self, optimizer instance. It will directly update variables in var_list
 
         """
+        self._step(loss, var_list, learning_rate, record, mode)
+        self._record_pending(loss)
 
+    def _step(self, loss, var_list, learning_rate, record, mode):
+        """One update with a single value and gradient evaluation of loss.
+
+        The value at the current variables is the loss after the previous
+        recorded update, so it fills that entry of loss_track; the loss after
+        this update is left pending for the next step or _record_pending.
+        """
         if isinstance(learning_rate, (int, float, np.number)):
             self.lr = learning_rate
         elif learning_rate is None:
@@ -58,73 +94,294 @@ class Optimizer():
             raise Exception("learning_rate should be int or float!")
 
         assert callable(loss), "loss should be a callable function!"
-        assert isinstance(var_list, (np.ndarray,list)), "var_list should be a variable list or array!"
+        assert isinstance(var_list, (np.ndarray, list, ADArray)), "var_list should be a variable list or array!"
         # Change to duck-typing check in each subclass, for performance consideration
         #for var in var_list:
         #    assert isinstance(var, AD), "Elements in var_list should be AD variables! Or make your var_list 1D!"
 
-        current_loss = loss()
+        assert mode in ('forward', 'reverse', 'trace'), "mode should be 'forward', 'reverse' or 'trace'!"
+        if mode == 'reverse':
+            current_loss = value_and_grad(loss)
+        elif mode == 'trace':
+            if (self._program is None) or (self._program.loss is not loss):
+                self._program = trace(loss)
+            current_loss = self._program.value_and_grad()
+        else:
+            current_loss = loss()
         assert isinstance(current_loss, AD), "The output of loss callable should be an AD instance!"
 
-        #add loss function value before optimization
-        if (self.iterations == 0) and (record == True):
-            self.loss_track.append(loss().func_val)
+        #add loss function value before optimization, or after the previous update
+        if (record == True) and ((self.iterations == 0) or self._pending):
+            self.loss_track.append(current_loss.func_val)
 
         # Apply the gradient to update variables.
         # This method should be implemeneted in each algorithm subclass
         grad_dict = current_loss.partial_dict
         #print("grad_dict: ", grad_dict)
+        # Frozen variables (requires_grad False) carry no derivatives
+        if not isinstance(var_list, ADArray) and not all(getattr(var, 'requires_grad', True) for var in var_list):
+            var_list = [var for var in var_list if getattr(var, 'requires_grad', True)]
         self._apply_gradient(loss, var_list, grad_dict)
 
         #print("current loss: ", loss())
         #print("current loss().func_val: ", loss().func_val)
         # Record the iteration number
         self.iterations += 1
-
-        #record loss function value for this iteration
-        if record == True:
-            self.loss_track.append(loss().func_val)
-
-    def minimize(self, loss, var_list, steps=100, learning_rates=None, record=False):
+        self._pending = (record == True)
+        return current_loss
+
+    def _record_pending(self, loss):
+        """Append the loss after the last recorded update to loss_track, as
+        a value only"""
+        if self._pending:
+            with AD.no_grad():
+                self.loss_track.append(loss().func_val)
+            self._pending = False
+
+    def minimize(self, loss, var_list, steps=None, learning_rates=None, record=False, mode='forward',
+                 inputs=None, outputs=None, batch_size=None, shuffle='batches', seed=None, epochs=1):
         """update multiple steps with user-specified learning_rate series
 
+        With inputs and outputs given, minimize runs in mini-batch mode: loss is
+        a function of (inputs, outputs, var_list), such as the functions of
+        boomdiff.loss_function, and each step evaluates it on one batch of
+        rows. Every epoch takes ceil(n / batch_size) steps, the last batch
+        holding the remaining rows, so steps should not be given.
+
         Parameters
         ----------
         loss: callable
             objective function, takes no arguments and output an AD instance.
+            In mini-batch mode, takes (inputs, outputs, var_list) instead.
 
         var_list: 1D list/array of AD instances (variables)
             the variable lists that you want to update. It can be part of the variables in loss callable.
 
-        steps: positive int
-            number of steps you want to update
+        steps: positive int, default None
+            number of steps you want to update; None takes 100 steps
 
         learning_rates: int, float, list of values, 1D numpy array of values
             use-specifed learning_rates, can be a list with length equal to step numbers
 
         record: Bool, default False
-            Whether you want to append the current loss to class attribute loss_track. 
+            Whether you want to append the current loss to class attribute loss_track.
+            Each step evaluates loss once, with its gradient, and that value is
+            recorded as the loss after the previous step; the final loss is
+            evaluated once at the end, in AD.no_grad mode.
+
+        mode: 'forward', 'reverse' or 'trace', default 'forward'
+            How the gradient of loss is computed, see step(). 'trace' is not
+            supported in mini-batch mode: the data is part of the trace, so
+            every batch would be traced again.
+
+        inputs, outputs: array_like, default None
+            Data for mini-batch mode, with one observation per row. inputs may
+            also be a boomdiff.data.NpyDataset (with outputs None): batches
+            are then read from its memory maps, and the epoch losses are
+            evaluated in blocks of batch_size rows.
+
+        batch_size: positive int, default None
+            Rows per batch; None uses all rows in a single batch
+
+        shuffle: 'batches', 'rows' or None, default 'batches'
+            'batches' visits the contiguous batches in a new random order every
+            epoch, so each batch is a view of the data (no copies). 'rows'
+            permutes the rows every epoch; each batch then copies its rows.
+            None visits the batches in order.
+
+        seed: int or None, default None
+            Seed of the random generator used for shuffling
+
+        epochs: positive int, default 1
+
+        In mini-batch mode with record=True, loss_track gets the batch loss of
+        every step (the value computed with its gradient) and epoch_loss_track
+        the loss on all rows, before the first epoch and after every epoch.
 
         Returns
         -------
         Self, Optimizer instance. It will directly update variables in var_list
         """
+        if inputs is not None:
+            return self._minimize_batches(loss, var_list, steps, learning_rates, record, mode,
+                                          inputs, outputs, batch_size, shuffle, seed, epochs)
+        steps = 100 if steps is None else steps
         assert (isinstance(steps, int)) & (steps > 0), "Steps should be positive int!"
 
         if isinstance(learning_rates, np.ndarray):
             assert (learning_rates.ndim == 1) & (len(learning_rates) == steps), "learning_rates should be 1D list/array with length equal to steps, or single value!"
             for i in range(steps):
-               self.step(loss, var_list, learning_rates[i], record)
+               self._step(loss, var_list, learning_rates[i], record, mode)
 
         elif isinstance(learning_rates, list):
             assert (len(learning_rates) == steps), "learning_rates should be 1D list/array with length equal to steps, or single value!"
             for i in range(steps):
-               self.step(loss, var_list, learning_rates[i], record)
+               self._step(loss, var_list, learning_rates[i], record, mode)
 
         else:
             for i in range(steps):
-               self.step(loss, var_list, learning_rates, record)
+               self._step(loss, var_list, learning_rates, record, mode)
+
+        self._record_pending(loss)
+
+    @staticmethod
+    def _batches(n, batch_size, shuffle, rng):
+        """Row selections of the batches of one epoch: slices (views of the
+        data) unless the rows are shuffled"""
+        starts = np.arange(0, n, batch_size)
+        if shuffle == 'rows':
+            order = rng.permutation(n)
+            # Sorted within a batch, so rows are read in memory order
+            return [np.sort(order[start:start + batch_size]) for start in starts]
+        if shuffle == 'batches':
+            starts = rng.permutation(starts)
+        return [slice(start, min(start + batch_size, n)) for start in starts.tolist()]
+
+    def _minimize_batches(self, loss, var_list, steps, learning_rates, record, mode,
+                          inputs, outputs, batch_size, shuffle, seed, epochs):
+        """Mini-batch mode of minimize"""
+        assert callable(loss), "loss should be a callable function!"
+        assert steps is None, "steps should not be given in mini-batch mode, use epochs and batch_size!"
+        assert mode in ('forward', 'reverse'), "mode should be 'forward' or 'reverse' in mini-batch mode!"
+        dataset = inputs if isinstance(inputs, NpyDataset) else None
+        if dataset is not None:
+            assert outputs is None, "outputs should not be given with an NpyDataset!"
+            inputs, outputs = dataset.inputs, dataset.outputs
+        else:
+            assert outputs is not None, "outputs should be given with inputs!"
+            inputs, outputs = np.asarray(inputs), np.asarray(outputs)
+        n = len(inputs)
+        assert len(outputs) == n, "inputs and outputs should have the same number of rows!"
+        batch_size = n if batch_size is None else batch_size
+        assert isinstance(batch_size, (int, np.integer)) and (batch_size > 0), "batch_size should be positive int!"
+        assert shuffle in ('batches', 'rows', None), "shuffle should be 'batches', 'rows' or None!"
+        assert isinstance(epochs, (int, np.integer)) and (epochs > 0), "epochs should be positive int!"
+
+        steps = epochs * -(-n // batch_size)
+        if isinstance(learning_rates, (list, np.ndarray)):
+            assert (np.ndim(learning_rates) == 1) & (len(learning_rates) == steps), \
+                "learning_rates should be 1D list/array with length epochs * number of batches, or single value!"
+        else:
+            learning_rates = [learning_rates] * steps
+
+        if dataset is not None:
+            full_loss = lambda: dataset.loss(loss, var_list, batch_size)
+        else:
+            full_loss = lambda: loss(inputs, outputs, var_list)
+        if record == True:
+            with AD.no_grad():
+                self.epoch_loss_track.append(full_loss().func_val)
+
+        rng = np.random.default_rng(seed)
+        i = 0
+        for epoch in range(epochs):
+            for rows in self._batches(n, batch_size, shuffle, rng):
+                batch_x, batch_y = inputs[rows], outputs[rows]
+                current_loss = self._step(lambda: loss(batch_x, batch_y, var_list), var_list,
+                                          learning_rates[i], False, mode)
+                if record == True:
+                    self.loss_track.append(current_loss.func_val)
+                i += 1
+            if record == True:
+                with AD.no_grad():
+                    self.epoch_loss_track.append(full_loss().func_val)
+
+    def retrace(self):
+        """Trace the loss again at the next step in mode='trace', after its
+        structure (branches, data, constants) changed"""
+        self._program = None
+
+    def _gather(self, var_list, grad_dict):
+        """Pack var_list for a vectorized update
 
+        Returns
+        -------
+        positions: int array, entries of the variables in the state arrays
+        values: float array, current values of the variables (a copy)
+        grads: float array, their partial derivatives in grad_dict. Warns
+            once if any of them is larger than 10**8. A variable missing from
+            grad_dict raises an AttributeError, unless it is frozen (see
+            AD.requires_grad) or pruning is enabled (see AD.set_pruning),
+            where a missing entry is a zero derivative
+        """
+        if isinstance(var_list, ADArray):
+            assert len(var_list.names) == var_list.size, \
+                "An ADArray var_list should hold one variable per element, see ADArray.from_array!"
+            names = var_list.names
+            values = var_list.func_val.astype(float).ravel()
+        else:
+            try:
+                names = [self._variable_name(var) for var in var_list]
+                values = np.fromiter((var.func_val for var in var_list), dtype=float, count=len(names))
+            except:
+                raise AttributeError("Var_list should be 1D, with AD instances as elements, which are variables in loss!")
+
+        if (self._layout is None) or (self._layout[0] != names):
+            index = self._state_index
+            positions = np.fromiter((index.setdefault(name, len(index)) for name in names),
+                                    dtype=np.int64, count=len(names))
+            self._layout = (names, positions)
+        positions = self._layout[1]
+
+        if isinstance(grad_dict, Partials):
+            # Look the slots up in the sorted slot array of the gradient
+            slots = grad_dict.registry.slots(names)
+            at = np.searchsorted(grad_dict.idx, slots)
+            found = at < len(grad_dict.idx)
+            found[found] = grad_dict.idx[at[found]] == slots[found]
+            grads = np.zeros(len(names))
+            grads[found] = grad_dict.val[at[found]]
+        else:
+            found = np.fromiter((name in grad_dict for name in names), dtype=bool, count=len(names))
+            grads = np.fromiter((grad_dict.get(name, 0.) for name in names), dtype=float, count=len(names))
+        if (AD._prune is None) and not found.all():
+            self._check_missing(var_list, ~found)
+        # Trivial numerical instability check
+        if np.any(np.abs(grads) > 10**8):
+            warnings.warn("Gradient is too large: potential numerical instability")
+        return positions, values, grads
+
+    @staticmethod
+    def _variable_name(var):
+        """Name of the variable var: the key of its partial_dict, or the only
+        key with a nonzero seed if it lists others with zero derivatives (an
+        element of an ADArray lists every name of the array)"""
+        ders = var.partial_dict if var.requires_grad else var._frozen
+        names = list(ders) if len(ders) == 1 else [k for k, v in ders.items() if v != 0]
+        if len(names) != 1:
+            raise AttributeError("Var_list should be 1D, with AD instances as elements, which are variables in loss!")
+        return names[0]
+
+    @staticmethod
+    def _check_missing(var_list, missing):
+        """Raise if a variable missing from the gradient is not frozen: the
+        loss does not depend on it"""
+        if isinstance(var_list, ADArray) or any(var.requires_grad for var, m in zip(var_list, missing) if m):
+            raise AttributeError("Var_list should be 1D, with AD instances as elements, which are variables in loss!")
+
+    def _state(self, positions, *attrs):
+        """Optimizer state arrays named attrs, at the given positions.
+        Variables seen for the first time (or after init) start at 0."""
+        size = len(self._state_index)
+        gathered = []
+        for attr in attrs:
+            state = getattr(self, attr, None)
+            if not isinstance(state, np.ndarray):
+                state = np.zeros(size)
+            elif len(state) < size:
+                state = np.concatenate((state, np.zeros(size - len(state))))
+            setattr(self, attr, state)
+            gathered.append(state[positions])
+        return gathered
+
+    @staticmethod
+    def _scatter(var_list, values):
+        """Write the updated values back to the variables"""
+        if isinstance(var_list, ADArray):
+            var_list.func_val[...] = values.reshape(var_list.shape)
+            return
+        for var, value in zip(var_list, values.tolist()):
+            var.func_val = value
 
     def _apply_gradient(self, loss, var_list, grad_dict):
         """
@@ -137,7 +394,7 @@ class Optimizer():
         '''
         Helper method, quickily plot the loss function value vs iteration step #
         '''
-        plt.plot(np.arange(self.iterations + 1), self.loss_track)
+        plt.plot(np.arange(len(self.loss_track)), self.loss_track)
         plt.xlabel("itertion #")
         plt.ylabel("loss function value")
         plt.show()
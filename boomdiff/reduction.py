@@ -0,0 +1,229 @@
+"""
+Reductions of arrays of AD instances in linear time
+"""
+
+__all__ = ['REDUCTIONS', 'reduce', 'value_and_weights']
+
+import numpy as np
+
+from boomdiff.autodiff import AD
+from boomdiff.registry import Partials
+
+
+REDUCTIONS = ('sum', 'mean', 'prod', 'max', 'min', 'norm', 'logsumexp')
+
+
+def value_and_weights(kind, values, axis=None):
+    """Value of a reduction of a float array and its partial derivatives with
+    respect to every element
+
+    Parameters
+    ----------
+    kind: str, one of 'prod', 'max', 'min', 'norm', 'logsumexp'
+    values: float numpy array
+    axis: int or None
+        reduce over this axis, or over all elements if None
+
+    Returns
+    -------
+    value: the reduced array (a float if axis is None)
+    weights: array of the shape of values, d value / d values. max and min
+        give a subgradient: 1 at the first extreme element, 0 elsewhere
+
+    Examples
+    --------
+    >>> value, weights = value_and_weights('prod', np.array([2., 3., 4.]))
+    >>> print(value, weights)
+    24.0 [12.  8.  6.]
+    """
+    values = np.asarray(values, dtype=float)
+    shape = values.shape
+    if axis is None:
+        values, axis = values.ravel(), 0
+    v = np.moveaxis(values, axis, -1)
+
+    if kind == 'prod':
+        ones = np.ones(v.shape[:-1] + (1,))
+        left = np.concatenate((ones, np.cumprod(v[..., :-1], axis=-1)), axis=-1)
+        right = np.concatenate((np.cumprod(v[..., :0:-1], axis=-1)[..., ::-1], ones), axis=-1)
+        value, weights = np.prod(v, axis=-1), left * right
+    elif kind in ('max', 'min'):
+        arg = np.argmax(v, axis=-1) if kind == 'max' else np.argmin(v, axis=-1)
+        value = np.take_along_axis(v, arg[..., None], axis=-1)[..., 0]
+        weights = np.zeros_like(v)
+        np.put_along_axis(weights, arg[..., None], 1., axis=-1)
+    elif kind == 'norm':
+        value = np.sqrt(np.sum(v * v, axis=-1))
+        # Subgradient 0 at the origin
+        weights = np.divide(v, value[..., None], out=np.zeros_like(v), where=value[..., None] > 0)
+    elif kind == 'logsumexp':
+        # Shift by the maximum so that exp never overflows
+        m = np.max(v, axis=-1, keepdims=True)
+        m = np.where(np.isfinite(m), m, 0.)
+        e = np.exp(v - m)
+        total = np.sum(e, axis=-1, keepdims=True)
+        value, weights = (np.log(total) + m)[..., 0], e / total
+    else:
+        raise ValueError(f'Unknown reduction {kind}!')
+
+    weights = np.moveaxis(weights, -1, axis).reshape(shape)
+    return (float(value) if np.ndim(value) == 0 else value), weights
+
+
+def _accumulate(elements, weights):
+    """Partial derivatives of sum_i weights[i] * elements[i], accumulated in
+    one pass with a single update per (element, variable) pair, instead of
+    copying a growing dictionary once per element. weights None stands for
+    all ones."""
+    pairs = [(x.partial_dict, 1. if weights is None else weights[i])
+             for i, x in enumerate(elements) if isinstance(x, AD)]
+    registries = {id(d.registry) for d, _ in pairs if isinstance(d, Partials)}
+    if len(registries) == 1 and all(isinstance(d, Partials) for d, _ in pairs):
+        # Vectorized: one scatter-add over the concatenated slot arrays
+        idx, inverse = np.unique(np.concatenate([d.idx for d, _ in pairs]), return_inverse=True)
+        val = np.bincount(inverse, weights=np.concatenate([d.val * w for d, w in pairs]), minlength=len(idx))
+        return Partials(idx, val, pairs[0][0].registry)
+
+    new_der_dict = {}
+    for der_dict, w in pairs:
+        for k, der in der_dict.items():
+            if weights is not None:
+                der = der * w
+            new_der_dict[k] = new_der_dict[k] + der if k in new_der_dict else der
+    return new_der_dict
+
+
+def _constant(kind, values, axis=None):
+    """Reduction of an array without AD instances, as plain NumPy"""
+    if kind in ('norm', 'logsumexp'):
+        return value_and_weights(kind, values, axis)[0]
+    return {'sum': np.sum, 'mean': np.mean, 'prod': np.prod, 'max': np.max, 'min': np.min}[kind](values, axis=axis)
+
+
+def _tree(elements, combine):
+    """Fold a list with a binary operation, as a balanced tree of pairs"""
+    while len(elements) > 1:
+        pairs = [combine(elements[i], elements[i + 1]) for i in range(0, len(elements) - 1, 2)]
+        elements = pairs + elements[len(pairs) * 2:]
+    return elements[0]
+
+
+def _tree_sum(elements):
+    """Sum through the AD additions, as a balanced tree of pairwise sums"""
+    return _tree(elements, lambda a, b: a + b)
+
+
+def _select(kind, a, b):
+    """max(a, b) or min(a, b) of AD instances or constants as one 'max' or
+    'min' operation, which a trace records and re-evaluates at every replay.
+    Ties select a, so a tree of them selects the first extreme element."""
+    va, vb = (x.func_val if isinstance(x, AD) else x for x in (a, b))
+    first = (va >= vb) if kind == 'max' else (va <= vb)
+    x = a if first else b
+    return AD._new(va if first else vb, x._shared_ders() if isinstance(x, AD) else {}, kind, a, b)
+
+
+def _fold(kind, elements, values):
+    """Reduction through the AD operations themselves, one per element. Used
+    while a trace is recording and for batched values. A trace records sums,
+    maxima and minima as trees of depth log2(n), which it replays one level
+    at a time."""
+    lane = np.empty(len(elements), dtype=object)
+    lane[:] = elements
+    if kind == 'sum' and getattr(AD._tape, 'elementwise', False):
+        return _tree_sum(list(elements))
+    if kind == 'sum':
+        return np.sum(lane)
+    if kind == 'prod':
+        return np.prod(lane)
+    if kind == 'norm':
+        return AD.sqrt(np.sum(lane * lane))
+    if any(isinstance(v, np.ndarray) for v in values):
+        raise ValueError(f'{kind} does not support batched values!')
+    if kind in ('max', 'min'):
+        return _tree(list(elements), lambda a, b: _select(kind, a, b))
+    # The shift is itself traced, so a replay shifts by the current maximum;
+    # its derivatives cancel
+    m = _tree(list(elements), lambda a, b: _select('max', a, b))
+    return AD.log(_tree_sum(list(AD.exp(lane - m)))) + m
+
+
+def _reduce_lane(kind, elements):
+    """Reduce a 1D sequence of AD instances and constants"""
+    values = [x.func_val if isinstance(x, AD) else x for x in elements]
+    if not any(isinstance(x, AD) for x in elements):
+        return _constant(kind, np.array(values, dtype=float))
+    if getattr(AD._tape, 'elementwise', False) or any(isinstance(v, np.ndarray) for v in values):
+        return _fold(kind, elements, values)
+
+    if kind in ('sum', 'prod'):
+        # Values are combined left to right, the same as a fold of the AD
+        # operators, so results do not depend on the reduction path
+        value = values[0]
+        for v in values[1:]:
+            value = value + v if kind == 'sum' else value * v
+        weights = None if kind == 'sum' else value_and_weights(kind, np.array(values, dtype=float))[1].tolist()
+        return AD._new(value, _accumulate(elements, weights))
+
+    value, weights = value_and_weights(kind, np.array(values, dtype=float))
+    if kind in ('max', 'min'):
+        # The selected element: its value and partial derivatives
+        x = elements[int(np.argmax(weights))]
+        if not isinstance(x, AD):
+            return x
+        return AD._new(x.func_val, x._shared_ders())
+    return AD._new(value, _accumulate(elements, weights.tolist()))
+
+
+def reduce(kind, a, axis=None):
+    """Reduce an array of AD instances over an axis in linear time
+
+    np.sum and friends fold the AD operators over the elements, and each
+    partial result copies a partial dictionary that keeps growing, so
+    reducing n elements that depend on distinct variables costs O(n**2).
+    Here the value of each reduction is computed from the element values and
+    the derivatives are accumulated once per element and variable. With an
+    active reverse mode tape the result is recorded as a single node.
+
+    Parameters
+    ----------
+    kind: str, one of REDUCTIONS
+        'max' and 'min' propagate the derivatives of the (first) extreme
+        element, 'norm' is the Euclidean norm and 'logsumexp' is evaluated
+        stably as m + log(sum(exp(a - m))) with m the maximum
+    a: array_like of AD instances and/or numbers
+    axis: int or None
+        reduce over this axis, or over all elements if None
+
+    Returns
+    -------
+    AD instance (or number) if axis is None, else an array of them
+
+    Examples
+    --------
+    >>> w = AD.from_array(np.array([1., 2., 3.]), 'w')
+    >>> print(reduce('sum', w * w))
+    14.0 ({'w_0': 2.0, 'w_1': 4.0, 'w_2': 6.0})
+    >>> print(reduce('max', w))
+    3.0 ({'w_2': 1.0})
+    >>> print(reduce('prod', AD.from_array(np.array([[1., 2.], [3., 4.]]), 'v'), axis=1))
+    [2.0 ({'v_0_0': 2.0, 'v_0_1': 1.0}) 12.0 ({'v_1_0': 4.0, 'v_1_1': 3.0})]
+    """
+    assert kind in REDUCTIONS, f"kind should be one of {REDUCTIONS}!"
+    arr = np.array(a)
+    if arr.dtype != object:
+        return _constant(kind, arr, axis)
+    if arr.size == 0:
+        return _constant(kind, arr.astype(float), axis)
+    if kind == 'mean':
+        n = arr.size if axis is None else arr.shape[axis]
+        return reduce('sum', arr, axis) / n
+
+    if axis is None:
+        return _reduce_lane(kind, arr.ravel().tolist())
+    assert -arr.ndim <= axis < arr.ndim, "axis is out of bounds!"
+    moved = np.moveaxis(arr, axis, -1)
+    out = np.empty(moved.shape[:-1], dtype=object)
+    for idx in np.ndindex(out.shape):
+        out[idx] = _reduce_lane(kind, moved[idx].tolist())
+    return out
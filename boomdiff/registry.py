@@ -0,0 +1,178 @@
+"""
+Integer variable registry and registry-backed partial derivative storage
+"""
+
+__all__ = ['VariableRegistry', 'Partials', 'default_registry']
+
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class VariableRegistry():
+    """
+    Maps each variable name to a fixed integer slot, so that partial
+    derivatives can be stored in NumPy arrays instead of string-keyed
+    dictionaries. Slots are handed out in order of first use.
+
+    Usage:
+    >>> reg = VariableRegistry()
+    >>> reg.slot('w_0'), reg.slot('w_1'), reg.slot('w_0')
+    (0, 1, 0)
+    >>> reg.names([1, 0])
+    ['w_1', 'w_0']
+    """
+
+    def __init__(self):
+        self._slots = {}
+        self._names = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._slots
+
+    def slot(self, name):
+        """Return the slot of name, registering it if it is new"""
+        try:
+            return self._slots[name]
+        except KeyError:
+            self._slots[name] = len(self._names)
+            self._names.append(name)
+            return self._slots[name]
+
+    def slots(self, names):
+        """Return the slots of several names as an integer array"""
+        return np.fromiter((self.slot(name) for name in names), dtype=np.int64)
+
+    def lookup(self, name):
+        """Return the slot of an already registered name; raise KeyError
+        otherwise"""
+        return self._slots[name]
+
+    def names(self, slots):
+        """Return the names of a sequence or array of slots"""
+        names = self._names
+        return [names[i] for i in np.asarray(slots).tolist()]
+
+
+# Registry shared by all Partials unless another one is passed explicitly
+default_registry = VariableRegistry()
+
+
+class Partials(Mapping):
+    """
+    Partial derivatives stored as a sorted array of registry slots plus an
+    array of values. Read-only dictionary view: indexing, iteration, keys(),
+    items() and comparison with a dict all work with variable names.
+
+    Combining two Partials (as in the sum or product rule) is a vectorized
+    set-union and scatter-add over the slot arrays rather than a Python loop
+    over string keys, which pays off once expressions depend on many
+    variables. Use AD.from_array(..., indexed=True) or pass a Partials
+    instance as der_dict to create AD variables backed by it.
+
+    Usage:
+    >>> p = Partials.from_dict({'a': 1.0, 'b': 2.0})
+    >>> q = Partials.from_dict({'b': 1.0, 'c': -1.0})
+    >>> Partials.combine(p, 2.0, q, 3.0)
+    {'a': 2.0, 'b': 7.0, 'c': -3.0}
+    >>> p['b']
+    2.0
+    >>> p == {'b': 2.0, 'a': 1.0}
+    True
+    """
+
+    __slots__ = ('idx', 'val', 'registry')
+
+    def __init__(self, idx, val, registry=None):
+        """
+        Parameters
+        ----------
+        idx: array_like of int
+            Sorted, unique registry slots
+        val: array_like of float
+            Partial derivative for each slot
+        registry: VariableRegistry, default default_registry
+        """
+        self.idx = np.asarray(idx, dtype=np.int64)
+        self.val = np.asarray(val, dtype=float)
+        self.registry = default_registry if registry is None else registry
+        assert self.idx.shape == self.val.shape, "idx and val should have the same length!"
+
+    @classmethod
+    def from_dict(cls, der_dict, registry=None):
+        """Build from a dictionary (or any mapping) of name: derivative"""
+        registry = default_registry if registry is None else registry
+        if isinstance(der_dict, Partials) and der_dict.registry is registry:
+            return der_dict
+        idx = registry.slots(der_dict.keys())
+        val = np.fromiter(der_dict.values(), dtype=float, count=len(idx))
+        order = np.argsort(idx)
+        return cls(idx[order], val[order], registry)
+
+    @classmethod
+    def seed(cls, name, value=1., registry=None):
+        """Partials of an independent variable: a single entry for name"""
+        registry = default_registry if registry is None else registry
+        return cls([registry.slot(name)], [value], registry)
+
+    # Mapping interface
+    def __getitem__(self, name):
+        slot = self.registry.lookup(name)
+        pos = np.searchsorted(self.idx, slot)
+        if pos < len(self.idx) and self.idx[pos] == slot:
+            return float(self.val[pos])
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.registry.names(self.idx))
+
+    def __len__(self):
+        return len(self.idx)
+
+    def keys(self):
+        return self.registry.names(self.idx)
+
+    def values(self):
+        return self.val.tolist()
+
+    def items(self):
+        return list(zip(self.registry.names(self.idx), self.val.tolist()))
+
+    def copy(self):
+        """Return a mutable dict copy"""
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    # Vectorized kernels
+    def scale(self, c):
+        """Return c * self"""
+        return Partials(self.idx, self.val * c, self.registry)
+
+    @staticmethod
+    def combine(p, a, q, b):
+        """Return p*a + q*b, the union of both slot sets with shared slots
+        added. p and q may be Partials or dicts keyed by variable name."""
+        registry = p.registry if isinstance(p, Partials) else q.registry
+        p = Partials.from_dict(p, registry)
+        q = Partials.from_dict(q, registry)
+
+        if p.idx is q.idx or np.array_equal(p.idx, q.idx):
+            return Partials(p.idx, p.val * a + q.val * b, registry)
+        idx, inverse = np.unique(np.concatenate((p.idx, q.idx)), return_inverse=True)
+        val = np.bincount(inverse, weights=np.concatenate((p.val * a, q.val * b)), minlength=len(idx))
+        return Partials(idx, val, registry)
+
+    @staticmethod
+    def accepts(p, q):
+        """Whether p and q should be combined with the Partials kernels: at
+        least one is Partials and the other one is keyed by variable names"""
+        if isinstance(p, Partials):
+            return isinstance(q, Partials) or all(isinstance(k, str) for k in q)
+        if isinstance(q, Partials):
+            return all(isinstance(k, str) for k in p)
+        return False
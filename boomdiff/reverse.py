@@ -0,0 +1,142 @@
+"""
+Reverse-mode (tape-based) automatic differentiation for AD expressions
+"""
+
+__all__ = ['Tape', 'value_and_grad']
+
+import numpy as np
+
+from boomdiff.autodiff import AD
+
+
+class _Node():
+    """Key that stands for a recorded intermediate inside a partial dictionary.
+    Hashed by identity, so it can never collide with a variable name."""
+
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __repr__(self):
+        return f'<node {self.index}>'
+
+
+class Tape():
+    """
+    Records an AD computation so that the gradient of a scalar output can be
+    obtained with one backward sweep.
+
+    While a tape is active, every AD instance created by an operation keeps
+    only the derivatives with respect to its direct operands, instead of the
+    full partial dictionary over all upstream variables. The forward pass then
+    costs O(1) per operation regardless of the number of variables, and
+    `gradient` accumulates the adjoints from the output back to the variables.
+
+    Usage:
+    >>> x = AD(2., 'x')
+    >>> y = AD(3., 'y')
+    >>> with Tape() as tape:
+    ...     f = x*y + AD.sin(x)
+    >>> grad = tape.gradient(f)
+    >>> print(round(grad['x'], 6), grad['y'])
+    2.583853 2.0
+    """
+
+    def __init__(self):
+        self.local_ders = []
+        self._outer = None
+
+    def __enter__(self):
+        self._outer = AD._tape
+        AD._tape = self
+        return self
+
+    def __exit__(self, *exc_info):
+        AD._tape = self._outer
+        self._outer = None
+        return False
+
+    def __len__(self):
+        return len(self.local_ders)
+
+    def record(self, der_dict, op=None, a=None, b=None):
+        """Store the local derivative dictionary of a new AD instance and
+        return the seed dictionary that instance should carry instead
+
+        Parameters
+        ----------
+        der_dict: dict
+            Derivatives of the new instance with respect to its operands
+            (recorded intermediates) and to any variables created off the tape.
+        op, a, b:
+            The operation that created the instance (see AD._new), not
+            needed here
+
+        Returns
+        -------
+        dict with a single entry, the new node with a seed of 1
+        """
+        node = _Node(len(self.local_ders))
+        self.local_ders.append(der_dict)
+        return {node: 1.}
+
+    def gradient(self, output):
+        """Backward sweep from output to the variables
+
+        Parameters
+        ----------
+        output: AD class instance
+            Result of a computation recorded on this tape.
+
+        Returns
+        -------
+        dict, partial derivatives of output with respect to every variable,
+        in the same form as a forward mode partial_dict
+        """
+        assert isinstance(output, AD), "output should be an AD instance!"
+        adjoints = [0.] * len(self.local_ders)
+        grad = {}
+
+        def accumulate(der_dict, adjoint):
+            for key, der in der_dict.items():
+                if isinstance(key, _Node):
+                    adjoints[key.index] += adjoint * der
+                else:
+                    grad[key] = grad.get(key, 0.) + adjoint * der
+
+        accumulate(output.partial_dict, 1.)
+        # Nodes are recorded in evaluation order, so a reversed walk visits
+        # every node after all of its consumers
+        for i in range(len(self.local_ders) - 1, -1, -1):
+            # Adjoints of batched computations are arrays, never skipped
+            if isinstance(adjoints[i], np.ndarray) or adjoints[i] != 0:
+                accumulate(self.local_ders[i], adjoints[i])
+        return grad
+
+
+def value_and_grad(loss):
+    """Evaluate a loss callable in reverse mode
+
+    Parameters
+    ----------
+    loss: callable
+        takes no arguments and outputs an AD instance
+
+    Returns
+    -------
+    A new AD instance with the value of loss() and its gradient as
+    partial_dict, i.e. the same result as forward mode evaluation
+
+    Examples
+    --------
+    >>> a = AD(2, 'a')
+    >>> b = AD(4, 'b')
+    >>> f = value_and_grad(lambda: a*b + a**2)
+    >>> print(f.func_val, f.partial_dict)
+    12 {'a': 8.0, 'b': 2.0}
+    """
+    with Tape() as tape:
+        output = loss()
+    assert isinstance(output, AD), "The output of loss callable should be an AD instance!"
+    return AD._new(output.func_val, tape.gradient(output))
@@ -0,0 +1,451 @@
+"""
+Trace-and-replay compilation of loss callables
+"""
+
+__all__ = ['Program', 'trace']
+
+import math
+from types import SimpleNamespace
+
+import numpy as np
+
+from boomdiff.autodiff import AD, _expit
+
+
+def _checked(math_fn, np_fn):
+    # Scalar math function; outside its domain fall back to NumPy, which
+    # returns nan or inf (with a warning) like forward mode does
+    def fn(a):
+        try:
+            return math_fn(a)
+        except (ValueError, OverflowError):
+            return float(np_fn(a))
+    return fn
+
+
+def _softplus(a):
+    # log(1 + exp(a)) without overflow
+    return max(a, 0.) + math.log1p(math.exp(-abs(a)))
+
+
+def _sigmoid(a):
+    if a >= 0:
+        return 1 / (1 + math.exp(-a))
+    e = math.exp(a)
+    return e / (1 + e)
+
+
+# The elementary functions of the rules, on floats (replay one instruction
+# at a time) and on float arrays (one group of instructions at a time)
+_SCALAR = SimpleNamespace(
+    sin=_checked(math.sin, np.sin), cos=_checked(math.cos, np.cos), tan=_checked(math.tan, np.tan),
+    arcsin=_checked(math.asin, np.arcsin), arccos=_checked(math.acos, np.arccos),
+    arctan=_checked(math.atan, np.arctan), sqrt=_checked(math.sqrt, np.sqrt), log=_checked(math.log, np.log),
+    exp=_checked(lambda a: math.e ** a, lambda a: np.e ** a), maximum=max, minimum=min,
+    sinh=_checked(math.sinh, np.sinh), cosh=_checked(math.cosh, np.cosh), tanh=_checked(math.tanh, np.tanh),
+    log1p=_checked(math.log1p, np.log1p), expm1=_checked(math.expm1, np.expm1),
+    softplus=_softplus, sigmoid=_sigmoid)
+_ARRAY = SimpleNamespace(
+    sin=np.sin, cos=np.cos, tan=np.tan, arcsin=np.arcsin, arccos=np.arccos, arctan=np.arctan, sqrt=np.sqrt,
+    log=np.log, exp=lambda a: np.e ** a, maximum=np.maximum, minimum=np.minimum,
+    sinh=np.sinh, cosh=np.cosh, tanh=np.tanh, log1p=np.log1p, expm1=np.expm1,
+    softplus=lambda a: np.logaddexp(0., a), sigmoid=_expit)
+
+
+def _rules(m):
+    """Primitive operations, with the elementary functions of m: opcode
+    name, value(a, b), local partial derivatives partials(a, b, out) ->
+    (d out/d a, d out/d b) and second derivatives second(a, b, out) ->
+    (d2 out/d a2, d2 out/d a d b, d2 out/d b2). Constant derivatives are
+    returned as scalars. Unary operations ignore b."""
+    return (
+        ('add', lambda a, b: a + b, lambda a, b, out: (1., 1.), lambda a, b, out: (0., 0., 0.)),
+        ('sub', lambda a, b: a - b, lambda a, b, out: (1., -1.), lambda a, b, out: (0., 0., 0.)),
+        ('mul', lambda a, b: a * b, lambda a, b, out: (b, a), lambda a, b, out: (0., 1., 0.)),
+        ('div', lambda a, b: a / b, lambda a, b, out: (1 / b, -a / b**2),
+         lambda a, b, out: (0., -1 / b**2, 2 * a / b**3)),
+        ('pow', lambda a, b: a ** b, lambda a, b, out: (b * a**(b - 1), out * m.log(a)),
+         lambda a, b, out: (b * (b - 1) * a**(b - 2), a**(b - 1) * (1 + b * m.log(a)), out * m.log(a)**2)),
+        # Larger / smaller operand, a on ties (see reduction._select)
+        ('max', lambda a, b: m.maximum(a, b), lambda a, b, out: (1. * (a >= b), 1. * (a < b)),
+         lambda a, b, out: (0., 0., 0.)),
+        ('min', lambda a, b: m.minimum(a, b), lambda a, b, out: (1. * (a <= b), 1. * (a > b)),
+         lambda a, b, out: (0., 0., 0.)),
+        # Power with a constant exponent / a constant base
+        ('powc', lambda a, b: a ** b, lambda a, b, out: (b * a**(b - 1), 0.),
+         lambda a, b, out: (b * (b - 1) * a**(b - 2), 0., 0.)),
+        ('rpowc', lambda a, b: a ** b, lambda a, b, out: (0., out * m.log(a)),
+         lambda a, b, out: (0., 0., out * m.log(a)**2)),
+        ('sin', lambda a, b: m.sin(a), lambda a, b, out: (m.cos(a), 0.), lambda a, b, out: (-out, 0., 0.)),
+        ('cos', lambda a, b: m.cos(a), lambda a, b, out: (-m.sin(a), 0.), lambda a, b, out: (-out, 0., 0.)),
+        ('tan', lambda a, b: m.tan(a), lambda a, b, out: (1 / m.cos(a)**2, 0.),
+         lambda a, b, out: (2 * out / m.cos(a)**2, 0., 0.)),
+        ('arcsin', lambda a, b: m.arcsin(a), lambda a, b, out: (1 / m.sqrt(1 - a**2), 0.),
+         lambda a, b, out: (a / m.sqrt(1 - a**2)**3, 0., 0.)),
+        ('arccos', lambda a, b: m.arccos(a), lambda a, b, out: (-1 / m.sqrt(1 - a**2), 0.),
+         lambda a, b, out: (-a / m.sqrt(1 - a**2)**3, 0., 0.)),
+        ('arctan', lambda a, b: m.arctan(a), lambda a, b, out: (1 / (1 + a**2), 0.),
+         lambda a, b, out: (-2 * a / (1 + a**2)**2, 0., 0.)),
+        ('sqrt', lambda a, b: m.sqrt(a), lambda a, b, out: (1 / (2 * out), 0.),
+         lambda a, b, out: (-1 / (4 * a * out), 0., 0.)),
+        # Natural logarithm; AD.log divides by log(base) with a 'div'
+        ('log', lambda a, b: m.log(a), lambda a, b, out: (1 / a, 0.), lambda a, b, out: (-1 / a**2, 0., 0.)),
+        ('exp', lambda a, b: m.exp(a), lambda a, b, out: (out, 0.), lambda a, b, out: (out, 0., 0.)),
+        ('sinh', lambda a, b: m.sinh(a), lambda a, b, out: (m.cosh(a), 0.), lambda a, b, out: (out, 0., 0.)),
+        ('cosh', lambda a, b: m.cosh(a), lambda a, b, out: (m.sinh(a), 0.), lambda a, b, out: (out, 0., 0.)),
+        ('tanh', lambda a, b: m.tanh(a), lambda a, b, out: (1 / m.cosh(a)**2, 0.),
+         lambda a, b, out: (-2 * out / m.cosh(a)**2, 0., 0.)),
+        ('log1p', lambda a, b: m.log1p(a), lambda a, b, out: (1 / (1 + a), 0.),
+         lambda a, b, out: (-1 / (1 + a)**2, 0., 0.)),
+        ('expm1', lambda a, b: m.expm1(a), lambda a, b, out: (out + 1, 0.), lambda a, b, out: (out + 1, 0., 0.)),
+        ('softplus', lambda a, b: m.softplus(a), lambda a, b, out: (m.sigmoid(a), 0.),
+         lambda a, b, out: (m.sigmoid(a) * m.sigmoid(-a), 0., 0.)),
+        ('log_sigmoid', lambda a, b: -m.softplus(-a), lambda a, b, out: (m.sigmoid(-a), 0.),
+         lambda a, b, out: (-m.sigmoid(a) * m.sigmoid(-a), 0., 0.)),
+    )
+
+
+_SCALAR_RULES, _ARRAY_RULES = _rules(_SCALAR), _rules(_ARRAY)
+OPCODES = {rule[0]: op for op, rule in enumerate(_ARRAY_RULES)}
+_VALUE = [rule[1] for rule in _SCALAR_RULES]
+_PARTIALS = [rule[2] for rule in _SCALAR_RULES]
+_GROUP_VALUE = [rule[1] for rule in _ARRAY_RULES]
+_GROUP_PARTIALS = [rule[2] for rule in _ARRAY_RULES]
+_GROUP_SECOND = [rule[3] for rule in _ARRAY_RULES]
+# Operations of one operand (b is a copy of a)
+_UNARY = {op for op, rule in enumerate(_ARRAY_RULES)
+          if rule[0] not in ('add', 'sub', 'mul', 'div', 'max', 'min', 'pow', 'powc', 'rpowc')}
+
+
+def _scaled(adjoint, der):
+    """adjoint * der, 0 where the adjoint is 0 (so that an infinite or nan
+    local derivative of an operation that does not reach the output is not
+    propagated)"""
+    return np.multiply(adjoint, der, out=np.zeros(adjoint.shape), where=adjoint != 0)
+
+
+class _Slot():
+    """Key of the partial dictionary of an AD instance computed while
+    tracing: the slot of the program holding its value. Hashed by identity,
+    so it can never collide with a variable name."""
+
+    __slots__ = ('tracer', 'index')
+
+    def __init__(self, tracer, index):
+        self.tracer = tracer
+        self.index = index
+
+    def __repr__(self):
+        return f'<slot {self.index}>'
+
+
+class _Tracer():
+    """
+    Records the primitive AD operations of one loss() call. While active,
+    AD._tape points here: every AD operation reports its opcode and operands
+    to record(), and its result gets a partial dictionary {slot: 1.} naming
+    the slot that holds its value, the same way reverse.Tape marks its nodes.
+    """
+
+    # Reductions (boomdiff.reduction) must run as traced primitive operations
+    elementwise = True
+
+    def __init__(self):
+        self.leaves = {}        # id of a leaf AD instance -> (slot, instance);
+                                # the instances are kept, so ids stay unique
+        self.init = []          # initial slot values (constants, else 0.)
+        self.constant = []      # whether each slot holds a constant
+        self.code = []          # (opcode, out, a, b)
+        self._outer = None
+
+    def __enter__(self):
+        self._outer = AD._tape
+        AD._tape = self
+        return self
+
+    def __exit__(self, *exc_info):
+        AD._tape = self._outer
+        self._outer = None
+        return False
+
+    def record(self, der_dict, op=None, a=None, b=None):
+        """Record the operation op(a, b) that created a new AD instance and
+        return the partial dictionary of that instance
+
+        Parameters
+        ----------
+        der_dict: dict
+            Partial derivatives computed by the operation, not needed here
+        op: str or None
+            An opcode of _rules(), 'pow' (traced as 'pow', 'powc' or 'rpowc'),
+            or 'input' for an instance created with AD(): a new leaf, read
+            at every replay with the value and derivatives it had when
+            traced. None is an operation that cannot be traced.
+        a, b: operands, AD instances or numbers; b is None for unary
+            operations
+
+        Returns
+        -------
+        dict with a single entry, the slot of the result with a seed of 1
+        (der_dict itself for an input)
+        """
+        if op == 'input':
+            return der_dict
+        if op is None:
+            raise ValueError("loss creates AD instances outside the traceable AD operations (e.g. with an ADArray) "
+                             "and cannot be traced!")
+        a_slot = self.operand(a)
+        b_slot = a_slot if b is None else self.operand(b)
+        if op == 'pow' and self.constant[b_slot]:
+            op = 'powc'
+        elif op == 'pow' and self.constant[a_slot]:
+            op = 'rpowc'
+        out = self._new_slot(0., False)
+        self.code.append((OPCODES[op], out, a_slot, b_slot))
+        return {_Slot(self, out): 1.}
+
+    def _new_slot(self, value, constant):
+        self.init.append(value)
+        self.constant.append(constant)
+        return len(self.init) - 1
+
+    def operand(self, x):
+        """Return the slot of an operand, registering constants and AD
+        instances not produced by a traced operation (the leaves)"""
+        if not isinstance(x, AD):
+            return self._new_slot(float(x), True)
+        ders = x.partial_dict
+        if type(ders) is dict and len(ders) == 1:
+            key = next(iter(ders))
+            if isinstance(key, _Slot) and key.tracer is self:
+                return key.index
+        if id(x) not in self.leaves:
+            self.leaves[id(x)] = (self._new_slot(0., False), x)
+        return self.leaves[id(x)][0]
+
+
+class Program():
+    """
+    A loss callable traced once into a flat program of primitive operations.
+
+    Tracing calls loss() a single time and records every primitive AD
+    operation (arithmetic, power, the elementwise functions and the pairwise
+    maximum and minimum of reductions) as an instruction (opcode, output
+    slot, operand slots) of an integer array.
+    Constants are stored in their slots, and AD instances that are not the
+    result of a traced operation -- the variables -- are read again at every
+    replay. The instructions are grouped by opcode and by depth in the
+    expression graph, and value() and value_and_grad() re-evaluate every
+    group with one NumPy operation over a float array of slot values, in a
+    forward sweep and a reverse sweep, without building any intermediate AD
+    instance or partial dictionary.
+
+    The program reflects the structure of loss() at tracing time: branches
+    on values, the constants and data it uses, and the values of AD
+    instances it creates with AD() are all frozen. Call retrace() after any
+    of these changes. ADArray operations and batched values cannot be
+    traced and raise a ValueError.
+
+    Usage:
+    >>> x = AD(1., 'x')
+    >>> y = AD(2., 'y')
+    >>> program = trace(lambda: x*y + AD.sin(x))
+    >>> len(program)
+    3
+    >>> x.func_val = 0.
+    >>> print(program.value_and_grad())
+    0.0 ({'x': 3.0, 'y': 0.0})
+    """
+
+    def __init__(self, loss):
+        """
+        Parameters
+        ----------
+        loss: callable
+            takes no arguments and outputs an AD instance
+        """
+        assert callable(loss), "loss should be a callable function!"
+        self.loss = loss
+        self.retrace()
+
+    def retrace(self):
+        """Call loss() again and rebuild the program, after the structure of
+        the loss changed"""
+        with _Tracer() as tracer:
+            output = self.loss()
+        assert isinstance(output, AD), "The output of loss callable should be an AD instance!"
+
+        self._output = tracer.operand(output)
+        self._init = np.array(tracer.init, dtype=float)
+        self._leaf_slots = np.array([slot for slot, _ in tracer.leaves.values()], dtype=np.int64)
+        self._leaf_list = self._leaf_slots.tolist()
+        self._leaves = [leaf for _, leaf in tracer.leaves.values()]
+        self._check_leaves()
+        # Instruction array, one row (opcode, out, a, b) per operation
+        self.instructions = np.array(tracer.code, dtype=np.int64).reshape(-1, 4)
+
+        # Depth of every slot: 0 for leaves and constants, else one more
+        # than the deepest operand. Instructions of the same depth do not
+        # depend on each other, so each (depth, opcode) group is evaluated
+        # at once.
+        depth = [0] * len(self._init)
+        for _, out, a, b in tracer.code:
+            depth[out] = max(depth[a], depth[b]) + 1
+        code = self.instructions
+        levels = np.array(depth, dtype=np.int64)[code[:, 1]]
+        order = np.lexsort((code[:, 0], levels))
+        code, levels = code[order], levels[order]
+        starts = np.flatnonzero(np.diff(levels * len(OPCODES) + code[:, 0])) + 1
+        self._groups = [(int(group[0, 0]), group[:, 1], group[:, 2], group[:, 3])
+                        for group in np.split(code, starts)] if len(code) else []
+        # Narrow programs (e.g. a chain of scalar operations) have groups of
+        # one or two instructions, which are faster one at a time on floats
+        self._grouped = 4 * len(self._groups) <= len(code)
+        self._forward_code = [(_VALUE[op], out, a, b) for op, out, a, b in tracer.code]
+        self._backward_code = [(_PARTIALS[op], out, a, b) for op, out, a, b in reversed(tracer.code)]
+
+    def _check_leaves(self):
+        if any(isinstance(leaf.func_val, np.ndarray) for leaf in self._leaves):
+            raise ValueError("Batched values cannot be traced!")
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def _run(self):
+        # Forward sweep: the value of every slot
+        if self._grouped:
+            values = self._init.copy()
+            values[self._leaf_slots] = [leaf.func_val for leaf in self._leaves]
+            for op, out, a, b in self._groups:
+                values[out] = _GROUP_VALUE[op](values[a], values[b])
+            return values
+        values = self._init.tolist()
+        for slot, leaf in zip(self._leaf_list, self._leaves):
+            values[slot] = leaf.func_val
+        for value, out, a, b in self._forward_code:
+            values[out] = value(values[a], values[b])
+        return values
+
+    def _backward(self, values):
+        # Reverse sweep, accumulating the adjoint of every operand. All the
+        # consumers of a slot are deeper than it, so its adjoint is complete
+        # when its group is reached.
+        if self._grouped:
+            adjoints = np.zeros(len(values))
+            adjoints[self._output] = 1.
+            for op, out, a, b in reversed(self._groups):
+                adjoint = adjoints[out]
+                der_a, der_b = _GROUP_PARTIALS[op](values[a], values[b], values[out])
+                np.add.at(adjoints, a, _scaled(adjoint, der_a))
+                if op not in _UNARY:
+                    np.add.at(adjoints, b, _scaled(adjoint, der_b))
+            return adjoints
+        adjoints = [0.] * len(values)
+        adjoints[self._output] = 1.
+        for partials, out, a, b in self._backward_code:
+            adjoint = adjoints[out]
+            if adjoint != 0:
+                der_a, der_b = partials(values[a], values[b], values[out])
+                adjoints[a] += adjoint * der_a
+                adjoints[b] += adjoint * der_b
+        return adjoints
+
+    def value(self):
+        """Return loss() evaluated at the current values of the variables"""
+        return float(self._run()[self._output])
+
+    def value_and_grad(self):
+        """Replay the program at the current values of the variables
+
+        Returns
+        -------
+        A new AD instance with the value of loss() and its gradient as
+        partial_dict, the same result as forward mode evaluation
+        """
+        self._check_leaves()
+        values = self._run()
+        adjoints = self._backward(values)
+        adjoints = [float(adjoints[slot]) for slot in self._leaf_list]
+        grad = {}
+        for adjoint, leaf in zip(adjoints, self._leaves):
+            for key, der in leaf.partial_dict.items():
+                grad[key] = grad.get(key, 0.) + adjoint * der
+        return AD._new(float(values[self._output]), grad)
+
+    def hessian_product(self, names, directions):
+        """Gradient and Hessian-matrix product at the current values of the
+        variables, by a forward (tangent) sweep followed by a reverse sweep
+        over the tangents (forward-over-reverse)
+
+        Parameters
+        ----------
+        names: list of str
+            Variable names, the order of the rows of the results
+        directions: array_like, shape (len(names), m)
+            Directions to multiply the Hessian with
+
+        Returns
+        -------
+        value: float
+        gradient: numpy array, shape (len(names),)
+        products: numpy array, shape (len(names), m), Hessian @ directions
+        """
+        directions = np.asarray(directions, dtype=float)
+        assert directions.ndim == 2 and directions.shape[0] == len(names), \
+            "directions should have shape (number of names, m)!"
+        self._check_leaves()
+        values = np.asarray(self._run(), dtype=float)
+        # Leaf seeds: d leaf / d variable, for the requested variables
+        seeds = np.array([[leaf.partial_dict.get(name, 0.) for name in names] for leaf in self._leaves],
+                         dtype=float).reshape(len(self._leaves), len(names))
+
+        def column(x, n):
+            # Local derivatives of a group as a column, against the tangents
+            return np.broadcast_to(x, (n,))[:, None]
+
+        tangents = np.zeros((len(values), directions.shape[1]))
+        tangents[self._leaf_slots] = seeds @ directions
+        local = []
+        for op, out, a, b in self._groups:
+            der_a, der_b = [column(der, len(out)) for der in _GROUP_PARTIALS[op](values[a], values[b], values[out])]
+            tangents[out] = der_a * tangents[a] + der_b * tangents[b]
+            local.append((der_a, der_b))
+
+        adjoints = np.zeros(len(values))
+        adjoints[self._output] = 1.
+        adjoint_tangents = np.zeros_like(tangents)
+        for (op, out, a, b), (der_a, der_b) in zip(reversed(self._groups), reversed(local)):
+            adjoint, adjoint_tangent = adjoints[out], adjoint_tangents[out]
+            np.add.at(adjoints, a, _scaled(adjoint, der_a[:, 0]))
+            np.add.at(adjoints, b, _scaled(adjoint, der_b[:, 0]))
+            second = [column(der, len(out)) for der in _GROUP_SECOND[op](values[a], values[b], values[out])]
+            weight = adjoint[:, None]
+            der_aa, der_ab, der_bb = [_scaled(weight, der) for der in second]
+            np.add.at(adjoint_tangents, a, der_aa * tangents[a] + der_ab * tangents[b] + der_a * adjoint_tangent)
+            np.add.at(adjoint_tangents, b, der_ab * tangents[a] + der_bb * tangents[b] + der_b * adjoint_tangent)
+
+        gradient = seeds.T @ adjoints[self._leaf_slots]
+        products = seeds.T @ adjoint_tangents[self._leaf_slots]
+        return float(values[self._output]), gradient, products
+
+
+def trace(loss):
+    """Trace a loss callable into a Program
+
+    Parameters
+    ----------
+    loss: callable
+        takes no arguments and outputs an AD instance
+
+    Returns
+    -------
+    Program, replayable with value() and value_and_grad()
+
+    Examples
+    --------
+    >>> w = AD.from_array(np.array([1., 2.]), 'w')
+    >>> program = trace(lambda: AD.sum((np.dot(np.array([[1., 1.], [0., 2.]]), w) - 1)**2))
+    >>> print(program.value_and_grad())
+    13.0 ({'w_0': 4.0, 'w_1': 16.0})
+    """
+    return Program(loss)
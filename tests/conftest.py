@@ -0,0 +1,17 @@
+import numpy as np
+
+def assert_close(result, expected):
+    # Compare two AD instances up to rounding; a missing partial derivative
+    # counts as zero
+    assert np.isclose(result.func_val, expected.func_val)
+    for k in set(result.partial_dict) | set(expected.partial_dict):
+        assert np.isclose(result.partial_dict.get(k, 0), expected.partial_dict.get(k, 0))
+
+def assert_same(ad_array, object_array):
+    # Compare an ADArray against the equivalent object array of AD instances
+    object_array = np.array(object_array)
+    assert ad_array.shape == object_array.shape
+    for idx, ele in np.ndenumerate(object_array):
+        assert np.isclose(ad_array[idx].func_val, ele.func_val)
+        for k, v in ele.partial_dict.items():
+            assert np.isclose(ad_array[idx].partial_dict.get(k, 0), v)
@@ -0,0 +1,207 @@
+import boomdiff
+from boomdiff import AD
+from boomdiff.adarray import ADArray
+import pytest
+import numpy as np
+from tests.conftest import assert_same
+
+@pytest.fixture
+def w():
+    return ADArray.from_array(np.array([0.5, -1.0, 2.0]), 'w')
+
+@pytest.fixture
+def X():
+    return np.array([[1., 2., 3.], [4., 5., 6.]])
+
+def test_from_array():
+    w = ADArray.from_array([[1, 2], [3, 4]], 'w')
+    assert w.func_val.dtype == float
+    assert w.name() == ['w_0_0', 'w_0_1', 'w_1_0', 'w_1_1']
+    assert w[1, 0] == AD(3.0, {'w_0_0': 0., 'w_0_1': 0., 'w_1_0': 1., 'w_1_1': 0.})
+    assert np.array_equal(w.jacobian(), np.eye(4))
+    with pytest.raises(AssertionError):
+        ADArray.from_array(3.0)
+
+def test_from_ad_roundtrip():
+    objs = AD.from_array(np.array([[1.5, 2.], [3., 4.]]), 'v')
+    packed = ADArray.from_ad(objs)
+    assert np.array_equal(AD.to_array(packed), AD.to_array(objs))
+    assert_same(packed, objs)
+    assert_same(packed, packed.to_objects())
+    with pytest.raises(AttributeError):
+        ADArray.from_ad([AD(1.), 2.])
+
+def test_arithmetic_matches_objects():
+    a_obj = AD.from_array(np.array([1.5, 2.0, 3.0]), 'a')
+    b_obj = AD.from_array(np.array([0.5, 4.0, 1.0]), 'b')
+    a = ADArray.from_ad(a_obj)
+    b = ADArray.from_ad(b_obj)
+    assert_same(a + b, a_obj + b_obj)
+    assert_same(a - b, a_obj - b_obj)
+    assert_same(a * b, a_obj * b_obj)
+    assert_same(a / b, a_obj / b_obj)
+    assert_same(a ** b, a_obj ** b_obj)
+    assert_same(2 - a, 2 - a_obj)
+    assert_same(2 / a, [2 / x for x in a_obj])
+    assert_same(a ** 3, [x ** 3 for x in a_obj])
+    assert_same(2 ** a, [2 ** x for x in a_obj])
+    assert_same(-a, [-x for x in a_obj])
+
+def test_mixed_with_ad(w):
+    c = AD(2.0, 'c')
+    assert_same(w * c, [x * c for x in w.to_objects()])
+    assert_same(c - w, [c - x for x in w.to_objects()])
+    assert_same(c / w, [c / x for x in w.to_objects()])
+    assert_same(c ** (w * 0.1), [c ** (x * 0.1) for x in w.to_objects()])
+
+def test_broadcasting(w, X):
+    out = X * w
+    assert out.shape == (2, 3)
+    assert out.der.shape == (2, 3, 3)
+    assert out[1, 2] == AD(12.0, {'w_0': 0., 'w_1': 0., 'w_2': 6.})
+    col = ADArray.from_array([1., 2.], 'c').reshape(2, 1)
+    assert (col + w).shape == (2, 3)
+    assert_same(col + w, col.to_objects() + w.to_objects())
+
+def test_matmul(w, X):
+    y = X @ w
+    assert np.allclose(y.func_val, X @ w.func_val)
+    assert np.allclose(y.jacobian(), X)
+    assert_same(AD.dot(X, w), np.dot(X, w.to_objects()))
+
+    W = ADArray.from_array(np.arange(6.).reshape(3, 2), 'W')
+    assert_same(X @ W, np.dot(X, W.to_objects()))
+    assert_same(W.T @ w, np.dot(W.to_objects().T, w.to_objects()))
+    assert_same((X @ W) @ np.array([1., -1.]), np.dot(np.dot(X, W.to_objects()), [1., -1.]))
+    # Full contraction gives an AD instance
+    f = w @ w
+    assert isinstance(f, AD)
+    assert f == AD.dot(w.to_objects(), w.to_objects())
+
+def test_reductions(w, X):
+    M = X * w
+    assert_same(M.sum(axis=0), AD.sum(M.to_objects(), axis=0))
+    assert_same(M.sum(axis=-1), AD.sum(M.to_objects(), axis=1))
+    assert_same(AD.mean(M, axis=1), AD.mean(M.to_objects(), axis=1))
+    total = AD.sum(M)
+    assert isinstance(total, AD)
+    assert np.isclose(total.func_val, AD.sum(M.to_objects()).func_val)
+    assert np.isclose(AD.mean(M).partial_dict['w_2'], 1.5)
+    with pytest.raises(AssertionError):
+        M.sum(axis=2)
+
+def test_functions():
+    x = ADArray.from_array([0.2, 0.5], 'x')
+    objs = x.to_objects()
+    for fn in [AD.sin, AD.cos, AD.tan, AD.arcsin, AD.arccos, AD.arctan, AD.sqrt,
+               AD.log, AD.sinh, AD.cosh, AD.tanh, AD.exp, AD.logistic]:
+        assert_same(fn(x), fn(objs))
+    # ADArray returns the logarithm in the requested base
+    assert_same(AD.log(x, 2), [AD.log(v) / np.log(2) for v in objs])
+    # The same meaning of base for AD, ADArray and traces
+    v = AD(np.e**4, 'v')
+    for base in [np.e, np.e**2, 10]:
+        assert_same(ADArray.from_ad([v]).log(base), [AD.log(v, base)])
+        assert np.isclose(AD.log(v, base).func_val, 4 / np.log(base))
+        assert np.isclose(boomdiff.trace.trace(lambda: AD.log(v, base)).value(), 4 / np.log(base))
+
+def test_optimizer_with_adarray():
+    x_true = np.array([1., -2., 0.5])
+    X = np.random.RandomState(0).normal(size=(20, 3))
+    y = X @ x_true
+    var_list = [AD(0., f'b_{i}') for i in range(3)]
+    loss = lambda: AD.mean((X @ ADArray.from_ad(var_list) - y)**2)
+    opt = boomdiff.optimize.GD(learning_rate=0.1)
+    opt.minimize(loss, var_list, steps=300)
+    assert np.allclose([v.func_val for v in var_list], x_true, atol=1e-3)
+
+def test_sparse_matches_dense(w, X):
+    ws = ADArray.from_array(w.func_val, 'w', sparse=True)
+    assert ws.is_sparse and not w.is_sparse
+    cases = [lambda v: X @ v, lambda v: X * v - v / 2, lambda v: (X * v).sum(axis=0),
+             lambda v: AD.mean(X * v, axis=1), lambda v: AD.sin(v) * v**2 + 2**v,
+             lambda v: (X * v).T[1:], lambda v: v.reshape(3, 1) @ np.ones((1, 2)),
+             lambda v: ADArray.from_array([1., 2.], 'c').reshape(2, 1) + v]
+    for f in cases:
+        dense, sp = f(w), f(ws)
+        assert sp.is_sparse
+        assert np.allclose(sp.func_val, dense.func_val)
+        assert np.allclose(sp.jacobian().toarray(), dense.jacobian())
+    assert AD.sum((X @ ws)**2) == AD.sum((X @ w)**2)
+    assert ws @ ws == w @ w
+    assert ws[1] == AD(-1.0, {'w_1': 1.0})
+    with pytest.raises(AssertionError):
+        ADArray.from_array(np.ones((2, 2, 2)), sparse=True)
+
+def test_sparse_from_ad():
+    # Each element depends on its own variable plus a shared one
+    z = AD(2.0, 'z')
+    for indexed in [False, True]:
+        objs = AD.from_array(np.array([[1., 2.], [3., 4.]]), 'sp', indexed=indexed) * z
+        packed = ADArray.from_ad(objs, sparse=True)
+        jac = packed.jacobian()
+        assert jac.shape == (4, 5) and jac.nnz == 8
+        assert_same(packed, objs)
+
+def test_numpy_dispatch(w, X):
+    objs = w.to_objects()
+    # ufuncs run the ADArray methods
+    for np_fn, ad_fn in [(np.sin, AD.sin), (np.cos, AD.cos), (np.tan, AD.tan), (np.arctan, AD.arctan),
+                         (np.exp, AD.exp), (np.tanh, AD.tanh), (np.sinh, AD.sinh), (np.cosh, AD.cosh)]:
+        assert_same(np_fn(w), ad_fn(objs))
+    pos = w * w + 0.1
+    assert_same(np.log(pos), AD.log(pos.to_objects()))
+    assert_same(np.sqrt(pos), AD.sqrt(pos.to_objects()))
+    assert_same(np.log10(pos), [AD.log(v) / np.log(10) for v in pos.to_objects()])
+    assert_same(np.square(w), objs**2)
+    assert_same(np.arcsin(w / 4), AD.arcsin(objs / 4))
+    # Binary ufuncs with an ndarray on either side, and matmul
+    assert_same(np.subtract(X, w), X - objs)
+    assert_same(np.divide(1., w), [1. / v for v in objs])
+    assert_same(np.power(w, 2), objs**2)
+    assert_same(np.matmul(X, w), np.dot(X, objs))
+    assert isinstance(X @ w, ADArray)
+    # Array functions
+    assert_same(np.dot(X, w), np.dot(X, objs))
+    assert np.sum(X * w) == AD.sum(X * w)
+    assert_same(np.mean(X * w, axis=0), AD.mean(X * w, axis=0))
+    assert np.reshape(w, (3, 1)).shape == (3, 1)
+    assert np.transpose(X * w).shape == (3, 2)
+    assert np.shape(X * w) == (2, 3) and np.ndim(w) == 1 and np.size(X * w, 0) == 2
+    # Unsupported functions and arguments are not dispatched
+    with pytest.raises(TypeError):
+        np.sum(w, keepdims=True)
+    with pytest.raises(TypeError):
+        np.mean(X * w, 0, float)
+    with pytest.raises(TypeError):
+        np.concatenate([w, w])
+    with pytest.raises(TypeError):
+        np.sign(w)
+    with pytest.raises(TypeError):
+        np.sin(w, out=np.zeros(3))
+
+def test_dot_fast_path(X):
+    objs = AD.from_array(np.array([0.5, -1.0, 2.0]), 'w')
+    y = AD.dot(X, objs)
+    assert isinstance(y, ADArray)
+    assert_same(y, np.dot(X, objs))
+    assert_same(AD.dot(objs, X.T), np.dot(objs, X.T))
+    W = AD.from_array(np.arange(6.).reshape(3, 2), 'W')
+    assert_same(AD.dot(X, W), np.dot(X, W))
+    # Mixed or non-AD operands keep the object path
+    assert not isinstance(AD.dot(X, [AD(1., 'a'), 2., 3.]), ADArray)
+    assert AD.dot([1., 2.], [3., 4.]) == 11.
+    # Reverse mode needs the elementwise operations on the tape
+    f = boomdiff.reverse.value_and_grad(lambda: AD.sum(AD.dot(X, objs)))
+    assert f == AD.sum(y)
+
+def test_dot_matrix_weights():
+    # A 2D weight matrix is packed sparse: one stored derivative per
+    # (output, weight) pair it depends on, not size**2 per element
+    rng = np.random.RandomState(1)
+    X = rng.normal(size=(4, 30))
+    W = AD.from_array(rng.normal(size=(30, 20)), 'W')
+    for y, expected in [(AD.dot(X, W), np.dot(X, W)), (AD.dot(W.T, X.T), np.dot(W.T, X.T))]:
+        assert isinstance(y, ADArray) and y.is_sparse
+        assert y.jacobian().nnz == 4 * 20 * 30
+        assert_same(y, expected)
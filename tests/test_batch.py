@@ -0,0 +1,51 @@
+import boomdiff
+from boomdiff import AD
+from boomdiff.reverse import value_and_grad
+import pytest
+import numpy as np
+
+points = np.array([0.1, 0.4, 0.7, 0.9])
+
+def f(x, y):
+    return (AD.sin(x)*y + AD.cos(x*y) - AD.tan(x) + AD.exp(x) - AD.log(x, 2) + x**y + 2**x - y/x
+            + AD.logistic(x) + AD.sqrt(x) + AD.arcsin(x) + AD.arccos(x) * AD.arctan(x)
+            + AD.sinh(x) - AD.cosh(x) + AD.tanh(x) + (-x) ** 2)
+
+def test_matches_pointwise():
+    x = AD(points, 'x')
+    y = AD(1.5, 'y')
+    batched = f(x, y)
+    assert batched.func_val.shape == points.shape
+    for i, p in enumerate(points):
+        single = f(AD(p, 'x'), y)
+        assert np.isclose(batched.func_val[i], single.func_val)
+        for k, v in single.partial_dict.items():
+            assert np.isclose(batched.partial_dict[k][i], v)
+
+def test_reverse_mode():
+    x = AD(points, 'x')
+    y = AD(1.5, 'y')
+    forward = f(x, y)
+    reverse = value_and_grad(lambda: f(x, y))
+    assert np.allclose(reverse.func_val, forward.func_val)
+    for k, v in forward.partial_dict.items():
+        assert np.allclose(reverse.partial_dict[k], v)
+
+def test_init_and_equality():
+    x = AD(np.array([1., 2.]), 'x')
+    assert np.array_equal(x.partial_dict['x'], [1., 1.])
+    assert x + 0 == AD(np.array([1., 2.]), {'x': 1.})
+    assert x != AD(np.array([1., 3.]), 'x')
+    assert x != AD(np.array([1., 2., 3.]), 'x')
+    assert x != AD(1., 'x')
+    y = AD(np.array([1, 2]), {'y': np.array([0.5, 2.])})
+    assert np.array_equal((x*y).partial_dict['y'], [0.5, 4.])
+    y.set_params('func_val', np.array([3., 4.]))
+    with pytest.raises(ValueError):
+        AD(np.ones((2, 2)), 'x')
+    with pytest.raises(ValueError):
+        AD(np.array(['a', 'b']), 'x')
+    with pytest.raises(ValueError):
+        AD(np.array([1., 2.]), {'x': np.ones((2, 2))})
+    with pytest.raises(ValueError):
+        AD(np.array([1., 2.]), boomdiff.registry.Partials.seed('x'))
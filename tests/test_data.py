@@ -0,0 +1,63 @@
+import boomdiff
+from boomdiff import AD
+from boomdiff.data import NpyDataset, csv_to_npy
+from boomdiff.loss_function import linear_mse, logistic_cross_entropy
+import pytest
+import numpy as np
+from tests.conftest import assert_close
+
+@pytest.fixture
+def XY():
+    rng = np.random.RandomState(4)
+    X = rng.normal(size=(57, 3))
+    return X, X @ np.array([1., -2., 0.5])
+
+@pytest.fixture
+def dataset(XY, tmp_path):
+    np.save(tmp_path / 'X.npy', XY[0])
+    np.save(tmp_path / 'y.npy', XY[1].reshape(-1, 1))
+    return NpyDataset(tmp_path / 'X.npy', tmp_path / 'y.npy')
+
+def test_blocks(XY, dataset):
+    X, y = XY
+    assert isinstance(dataset.inputs, np.memmap) and len(dataset) == 57 and dataset.outputs.shape == (57,)
+    blocks = list(dataset.blocks(10))
+    assert [len(b[0]) for b in blocks] == [10] * 5 + [7]
+    # Views of the memory map, read in order
+    assert all(np.shares_memory(bx, dataset.inputs) for bx, _ in blocks)
+    assert np.array_equal(np.concatenate([bx for bx, _ in blocks]), X)
+    shuffled = list(dataset.blocks(10, shuffle=True, seed=0))
+    assert sorted(by[0] for _, by in shuffled) == sorted(by[0] for _, by in blocks)
+    assert [by[0] for _, by in shuffled] == [by[0] for _, by in dataset.blocks(10, shuffle=True, seed=0)]
+    with pytest.raises(AssertionError):
+        NpyDataset(X, y[:-1])
+
+def test_blockwise_loss(XY, dataset):
+    X, y = XY
+    var_list = list(AD.from_array([0.3, -0.2, 0.1], 'b'))
+    for fn, outputs in [(linear_mse, y), (logistic_cross_entropy, (y > 0).astype(float))]:
+        data = NpyDataset(dataset.inputs, outputs)
+        result, expected = data.loss(fn, var_list, block_rows=8), fn(X, outputs, var_list)
+        assert_close(result, expected)
+
+def test_training(XY, dataset):
+    var_list = list(AD.from_array(np.zeros(3), 'b'))
+    opt = boomdiff.optimize.Adam(learning_rate=0.05)
+    opt.minimize(linear_mse, var_list, inputs=dataset, batch_size=16, seed=0, epochs=40, record=True)
+    assert len(opt.epoch_loss_track) == 41 and len(opt.loss_track) == 40 * 4
+    assert np.isclose(opt.epoch_loss_track[-1], linear_mse(*XY, var_list).func_val)
+    assert np.allclose(AD.to_array(var_list), [1., -2., 0.5], atol=0.05)
+    with pytest.raises(AssertionError):
+        opt.minimize(linear_mse, var_list, inputs=dataset, outputs=XY[1])
+
+def test_csv_to_npy(XY, tmp_path):
+    X, y = XY
+    path = tmp_path / 'data.csv'
+    np.savetxt(path, np.column_stack([y, X]), delimiter=';', header='y;a;b;c', comments='')
+    with open(path, 'a') as f:
+        f.write('\n')
+    data = csv_to_npy(path, tmp_path / 'X.npy', tmp_path / 'y.npy', output_column=0, delimiter=';',
+                      skip_header=1, chunk_rows=10)
+    assert isinstance(data.inputs, np.memmap)
+    assert np.allclose(data.inputs, X) and np.allclose(data.outputs, y)
+    assert np.allclose(np.load(tmp_path / 'X.npy'), X)
@@ -0,0 +1,69 @@
+import boomdiff
+from boomdiff import AD
+from boomdiff.hessian import hessian, hvp, hessian_operator
+from boomdiff.trace import trace
+import pytest
+import numpy as np
+from scipy.sparse.linalg import LinearOperator, cg
+
+@pytest.fixture
+def variables():
+    return [AD(0.7, 'x'), AD(0.3, 'y'), AD(1.2, 'z')]
+
+def numerical_hessian(loss, var_list, h=1e-6):
+    # Central differences of the exact gradient
+    names = [v.name()[0] for v in var_list]
+    program = trace(loss)
+    H = np.zeros((len(var_list), len(var_list)))
+    for j, var in enumerate(var_list):
+        var.func_val += h
+        g_plus = program.value_and_grad().partial_dict
+        var.func_val -= 2*h
+        g_minus = program.value_and_grad().partial_dict
+        var.func_val += h
+        H[:, j] = [(g_plus[n] - g_minus[n]) / (2*h) for n in names]
+    return H
+
+def test_all_functions(variables):
+    x, y, z = variables
+    loss = lambda: (AD.sin(x*y)**2 + AD.log(y)/x - 3**x + AD.logistic(x - y) + x**y + z**x
+                    + AD.cos(x) * AD.tan(y) + AD.arcsin(y) - AD.arccos(y) * z + AD.arctan(x*z)
+                    + AD.sqrt(x) / (1 - y) + AD.sinh(z) - AD.cosh(y) * AD.tanh(x) + AD.exp(x*z) - 2/z)
+    H = hessian(loss, variables)
+    assert np.allclose(H, H.T)
+    assert np.allclose(H, numerical_hessian(loss, variables), atol=1e-5)
+
+def test_order_and_quadratic(variables):
+    # Hessian of 0.5 w'Aw + b'w is A, rows and columns follow var_list
+    A = np.array([[2., 1., 0.], [1., 3., -1.], [0., -1., 4.]])
+    b = np.array([1., -2., 0.5])
+    loss = lambda: 0.5 * AD.dot(variables, AD.dot(A, variables)) + AD.dot(b, variables)
+    assert np.allclose(hessian(loss, variables), A)
+    order = [2, 0, 1]
+    assert np.allclose(hessian(loss, [variables[i] for i in order]), A[np.ix_(order, order)])
+    v = np.array([1., 2., -1.])
+    assert np.allclose(hvp(loss, variables, v), A @ v)
+
+def test_logistic_regression():
+    X = np.array([[1., 2.], [3., -1.], [0.5, 0.5]])
+    y = np.array([0, 1, 1])
+    w = AD.from_array(np.array([0.2, -0.1]), 'w')
+    loss = lambda: boomdiff.loss_function.logistic_cross_entropy(X, y, w)
+    p = 1 / (1 + np.exp(-X @ AD.to_array(w)))
+    expected = X.T @ np.diag(p * (1 - p)) @ X / len(y)
+    assert np.allclose(hessian(loss, list(w)), expected)
+
+def test_operator_and_program(variables):
+    x, y, z = variables
+    program = trace(lambda: (x - 1)**2 + 2*(y + x)**2 + 3*(z - 2)**2)
+    H = hessian_operator(program, variables)
+    assert isinstance(H, LinearOperator) and H.shape == (3, 3)
+    assert np.allclose(H @ np.eye(3), hessian(program, variables))
+    # One Newton step with conjugate gradients solves the quadratic exactly
+    grad = program.value_and_grad().partial_dict
+    step, info = cg(H, -np.array([grad[v.name()[0]] for v in variables]))
+    for var, s in zip(variables, step):
+        var.func_val += s
+    assert np.allclose([v.func_val for v in variables], [1., -1., 2.])
+    with pytest.raises(AssertionError):
+        hvp(program, variables, [1., 2.])
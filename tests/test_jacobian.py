@@ -0,0 +1,47 @@
+import boomdiff
+from boomdiff import AD
+from boomdiff.adarray import ADArray
+import pytest
+import numpy as np
+
+def numerical_jacobian(f, x0, h=1e-6):
+    x0 = np.array(x0, dtype=float)
+    cols = []
+    for j in range(x0.size):
+        e = np.zeros(x0.size)
+        e[j] = h
+        plus = AD.to_array(f(ADArray.from_array(x0 + e.reshape(x0.shape)))).ravel()
+        minus = AD.to_array(f(ADArray.from_array(x0 - e.reshape(x0.shape)))).ravel()
+        cols.append((plus - minus) / (2*h))
+    return np.stack(cols, axis=1)
+
+def test_vector_function():
+    A = np.array([[1., 2., 0.], [0., -1., 3.]])
+    f = lambda x: AD.exp(AD.dot(A, x)) + x[0] * AD.sin(x[1:])
+    x0 = np.array([0.3, -0.2, 0.5])
+    J = AD.jacobian(f, x0)
+    assert J.shape == (2, 3)
+    assert np.allclose(J, numerical_jacobian(f, x0))
+    for chunk_size in [1, 2, 5]:
+        assert np.array_equal(AD.jacobian(f, x0, chunk_size=chunk_size), J)
+
+def test_matrix_input_and_outputs():
+    W0 = np.array([[1., 2.], [3., 4.]])
+    # 2-D input, flattened in C order; scalar output gives one row
+    J = AD.jacobian(lambda W: AD.sum(W**2), W0)
+    assert np.allclose(J, 2 * W0.reshape(1, -1))
+    # Lists of AD instances and constants, and closure variables are ignored
+    c = AD(2., 'c')
+    J = AD.jacobian(lambda W: [W[0, 0] * c, 3., W[1, 1] - W[0, 1]], W0, chunk_size=3)
+    assert np.array_equal(J, [[2., 0., 0., 0.], [0., 0., 0., 0.], [0., -1., 0., 1.]])
+    # Matrix valued output
+    J = AD.jacobian(lambda W: W.T @ W, W0)
+    assert J.shape == (4, 4)
+    assert np.allclose(J, numerical_jacobian(lambda W: W.T @ W, W0))
+    assert np.array_equal(AD.jacobian(lambda x: x * 3, 2.), [[3.]])
+
+def test_bad_input():
+    with pytest.raises(AssertionError):
+        AD.jacobian(lambda x: x, np.ones((2, 2, 2)))
+    with pytest.raises(AssertionError):
+        AD.jacobian(lambda x: x, np.ones(3), chunk_size=0)
@@ -3,6 +3,9 @@ from boomdiff import AD
 import doctest
 import pytest
 import numpy as np
+from boomdiff.adarray import ADArray
+from boomdiff.loss_function import Dataset, linear_mse, logistic_cross_entropy
+from tests.conftest import assert_close
 
 
 @pytest.fixture
@@ -62,4 +65,101 @@ def test_ce_outputdim():
     v1 = AD(1., 'v1')
     v2 = AD(1., 'v2')
     with pytest.raises(AssertionError):
-        boomdiff.loss_function.logistic_cross_entropy(x, y, [v1, v2])   
\ No newline at end of file
+        boomdiff.loss_function.logistic_cross_entropy(x, y, [v1, v2])
+
+
+def test_closed_form_losses():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(50, 3))
+    y = (rng.uniform(size=50) > 0.5).astype(float)
+    s = AD(0.5, 's')
+    for var_list in [list(AD.from_array([0.3, -0.2, 0.1], 'b')), list(AD.from_array([0.3, -0.2, 0.1], 'b', indexed=True)),
+                     [AD(0.3, 'b_0') * s, AD(-0.2, 'b_1') + s, AD.sin(s)], ADArray.from_array([0.3, -0.2, 0.1], 'b')]:
+        objs = var_list.to_objects() if isinstance(var_list, ADArray) else var_list
+        z = [sum(X[i, j] * objs[j] for j in range(3)) for i in range(50)]
+        mse = boomdiff.loss_function.linear_mse(X, y, var_list)
+        assert_close(mse, sum((y[i] - z[i])**2 for i in range(50)) / 50)
+        ce = boomdiff.loss_function.logistic_cross_entropy(X, y, var_list)
+        assert_close(ce, -sum(y[i] * AD.log(AD.logistic(z[i])) + (1 - y[i]) * AD.log(1 - AD.logistic(z[i]))
+                              for i in range(50)) / 50)
+        # Reverse mode, traces and no_grad give the same results
+        for fn, expected in [(boomdiff.loss_function.linear_mse, mse), (boomdiff.loss_function.logistic_cross_entropy, ce)]:
+            loss = lambda: fn(X, y, var_list)
+            assert_close(boomdiff.reverse.value_and_grad(loss), expected)
+            if not isinstance(var_list, ADArray):
+                assert_close(boomdiff.trace.trace(loss).value_and_grad(), expected)
+            with AD.no_grad():
+                assert loss().func_val == expected.func_val and loss().partial_dict == {}
+    # Finite for saturated predictions
+    ce = boomdiff.loss_function.logistic_cross_entropy(X * 1000., y, list(AD.from_array([0.3, -0.2, 0.1], 'b')))
+    assert np.isfinite(ce.func_val) and all(np.isfinite(list(ce.partial_dict.values())))
+    with pytest.raises(AssertionError):
+        boomdiff.loss_function.linear_mse(X, y, [s])
+    with pytest.raises(AssertionError):
+        boomdiff.loss_function.logistic_cross_entropy(X, y + 0.5, [s, s, s])
+
+def test_dataset():
+    rng = np.random.RandomState(2)
+    X = rng.normal(size=(40, 3))
+    y = (rng.uniform(size=(40, 1)) > 0.5).astype(int)
+    var_list = list(AD.from_array([0.3, -0.2, 0.1], 'b'))
+    for loss, fn in [('linear_mse', linear_mse), ('logistic_cross_entropy', logistic_cross_entropy)]:
+        for order in ['C', 'F']:
+            data = Dataset(X, y, loss, order=order)
+            assert data.inputs.dtype == float and data.inputs.flags[order + '_CONTIGUOUS']
+            assert data.outputs.shape == (40,) and len(data) == 40
+            assert_close(data(var_list), fn(X, y, var_list))
+            assert_close(boomdiff.trace.trace(lambda: data(var_list)).value_and_grad(), fn(X, y, var_list))
+    data = Dataset(X, X @ np.array([1., -2., 0.5]))
+    assert np.allclose(data.xtx, X.T @ X)
+    opt = boomdiff.optimize.GD(learning_rate=0.1)
+    opt.minimize(lambda: data(var_list), var_list, steps=500)
+    assert np.allclose(AD.to_array(var_list), [1., -2., 0.5])
+    with pytest.raises(AssertionError):
+        Dataset(X, y, 'hinge')
+    with pytest.raises(AssertionError):
+        Dataset(X, y[:-1])
+    with pytest.raises(ValueError):
+        Dataset(X, y[:-1], 'logistic_cross_entropy')
+    with pytest.raises(AssertionError):
+        Dataset(X, y + 1, 'logistic_cross_entropy')
+    with pytest.raises(AssertionError):
+        data(var_list[:2])
+
+def test_dataset_value_near_optimum():
+    # Small residuals next to large outputs: the value comes from the
+    # residuals, as in linear_mse, not from the Gram terms
+    rng = np.random.RandomState(4)
+    X = rng.normal(size=(2000, 3))
+    beta = np.array([1., -2., 0.5])
+    y = X @ beta + 1e-3 * rng.normal(size=2000)
+    var_list = list(AD.from_array(beta, 'b'))
+    for chunk_rows in [None, 300]:
+        expected = linear_mse(X, y, var_list, chunk_rows)
+        result = Dataset(X, y, chunk_rows=chunk_rows)(var_list)
+        assert result.func_val == expected.func_val
+        assert_close(result, expected)
+
+def test_chunked_losses():
+    rng = np.random.RandomState(3)
+    X = rng.normal(size=(50, 3))
+    y = (rng.uniform(size=50) > 0.5).astype(float)
+    var_list = list(AD.from_array([0.3, -0.2, 0.1], 'b'))
+    for fn in [linear_mse, logistic_cross_entropy]:
+        expected = fn(X, y, var_list)
+        for chunk_rows in [1, 7, 50, 64]:
+            assert_close(fn(X, y, var_list, chunk_rows), expected)
+            assert_close(fn(X, y, ADArray.from_ad(var_list), chunk_rows=chunk_rows), expected)
+            # Composed fallback, and values only in no_grad mode
+            loss = lambda: fn(X, y, var_list, chunk_rows=chunk_rows)
+            assert_close(boomdiff.trace.trace(loss).value_and_grad(), expected)
+            with AD.no_grad():
+                assert np.isclose(loss().func_val, expected.func_val) and loss().partial_dict == {}
+        assert_close(Dataset(X, y, fn.__name__, chunk_rows=7)(var_list), expected)
+        with pytest.raises(AssertionError):
+            fn(X, y, var_list, chunk_rows=0)
+    # A full-batch step taken from the accumulated gradient
+    targets = X @ np.array([1., -2., 0.5])
+    opt = boomdiff.optimize.GD(learning_rate=0.1)
+    opt.minimize(lambda: linear_mse(X, targets, var_list, chunk_rows=8), var_list, steps=500)
+    assert np.allclose(AD.to_array(var_list), [1., -2., 0.5])
@@ -56,3 +56,137 @@ def test_warnings(var1, var2):
     opt = boomdiff.optimize.Momentum(learning_rate=0.1)
     with pytest.warns(UserWarning):
         opt.minimize(loss, var_list=[var1, var2])
+
+def test_frozen_variables(var1, var2):
+    head = AD(0., 'head')
+    loss = lambda: (head + var1 - 3)**2 + var2**2
+    for opt in [boomdiff.optimize.GD(learning_rate=0.1), boomdiff.optimize.Adam(learning_rate=0.1),
+                boomdiff.optimize.Momentum(learning_rate=0.1)]:
+        for mode in ['forward', 'reverse', 'trace']:
+            with AD.frozen([var1, var2]):
+                opt.minimize(loss, [head, var1, var2], steps=2, mode=mode)
+                assert loss().name() == ['head']
+            assert var1 == AD(100, {'var1': 1}) and var2 == AD(1, {'var2': 1})
+            assert head.func_val != 0.
+
+def test_record_without_derivatives(var1, var2):
+    seen = []
+    def loss():
+        f = var1**2 + var2**2
+        seen.append(f.partial_dict)
+        return f
+    opt = boomdiff.optimize.GD(learning_rate=0.1)
+    opt.minimize(loss, [var1, var2], steps=2, record=True)
+    # One evaluation per step, whose value is recorded, and a value-only
+    # evaluation of the final loss
+    assert [len(p) for p in seen] == [2, 2, 0]
+    assert opt.loss_track == [10001., 6400.64, 4096.4096]
+    # A later single step records the loss after its update
+    opt.step(loss, [var1, var2], record=True)
+    assert [len(p) for p in seen[3:]] == [2, 0]
+    assert np.allclose(opt.loss_track[2:], [4096.4096, 2621.702144])
+    opt.minimize(loss, [var1, var2], steps=2, record=True, mode='reverse')
+    assert len(seen) == 8 and len(opt.loss_track) == 6
+    assert np.isclose(opt.loss_track[-1], 2621.702144 * 0.64**2)
+
+def test_record_keeps_variables():
+    # Recording evaluates the loss again in no_grad mode, which must not
+    # change the variables, even with in-place operators in the loss
+    for record in ['minimize', 'step']:
+        w = list(AD.from_array(np.array([1., 2.]), 'w'))
+        def loss():
+            out = w[0]
+            out += w[1] * 3.
+            return out * out
+        opt = boomdiff.optimize.GD(learning_rate=0.0)
+        if record == 'minimize':
+            opt.minimize(loss, w, steps=3, record=True)
+        else:
+            for _ in range(3):
+                opt.step(loss, w, record=True)
+        assert w[0] == AD(1., 'w_0') and w[1] == AD(2., 'w_1')
+        assert opt.loss_track == [49.] * 4
+
+def test_packed_updates():
+    from boomdiff.adarray import ADArray
+    X = np.random.RandomState(1).normal(size=(30, 4))
+    y = X @ np.array([1., -2., 0.5, 3.])
+    for opt_class in [boomdiff.optimize.GD, boomdiff.optimize.Momentum, boomdiff.optimize.Adam]:
+        # The same updates for AD lists, indexed AD lists and an ADArray
+        plain = list(AD.from_array(np.zeros(4), 'p'))
+        indexed = list(AD.from_array(np.zeros(4), 'p', indexed=True))
+        packed = ADArray.from_array(np.zeros(4), 'p')
+        for var_list in [plain, indexed, packed]:
+            opt = opt_class(learning_rate=0.05)
+            opt.minimize(lambda: AD.mean((X @ ADArray.from_ad(var_list) - y)**2) if isinstance(var_list, list)
+                         else AD.mean((X @ var_list - y)**2), var_list, steps=20)
+        assert np.allclose(AD.to_array(plain), AD.to_array(indexed))
+        assert np.allclose(AD.to_array(plain), packed.func_val)
+    # State follows variable names when var_list changes between steps
+    a, b, c = AD(1., 'a'), AD(2., 'b'), AD(3., 'c')
+    loss = lambda: a**2 + b**2 + c**2
+    opt = boomdiff.optimize.Momentum(learning_rate=0.1)
+    opt.step(loss, [a, b])
+    opt.step(loss, [c, a])
+    # a: v = 0.2, then 0.9*0.2 + 0.1*1.6; c: first step
+    assert np.isclose(a.func_val, 1. - 0.2 - (0.9 * 0.2 + 0.1 * 1.6))
+    assert np.isclose(c.func_val, 3. - 0.6) and np.isclose(b.func_val, 1.6)
+    assert np.allclose(opt.last_update, [0.34, 0.4, 0.6])
+    opt.init(learning_rate=0.1)
+    opt.step(loss, [a])
+    assert np.isclose(opt.last_update[0], 0.1 * 2 * a.func_val / 0.8)
+    with pytest.raises(AssertionError):
+        opt.step(loss, ADArray.from_ad([a * b]))
+
+def test_minibatch():
+    from boomdiff.loss_function import linear_mse, logistic_cross_entropy
+    rng = np.random.RandomState(3)
+    X = rng.normal(size=(103, 3))
+    beta = np.array([1., -2., 0.5])
+    y = X @ beta
+    for opt_class in [boomdiff.optimize.GD, boomdiff.optimize.Momentum, boomdiff.optimize.Adam]:
+        for shuffle in ['batches', 'rows', None]:
+            var_list = list(AD.from_array(np.zeros(3), 'b'))
+            opt = opt_class(learning_rate=0.05)
+            opt.minimize(linear_mse, var_list, inputs=X, outputs=y, batch_size=10, shuffle=shuffle,
+                         seed=0, epochs=30, record=True)
+            assert opt.iterations == 30 * 11 and len(opt.loss_track) == 30 * 11
+            assert len(opt.epoch_loss_track) == 31 and opt.epoch_loss_track[-1] < 1e-3
+            assert np.allclose(AD.to_array(var_list), beta, atol=0.05)
+    # Batches are views of the data unless rows are shuffled
+    seen = []
+    def loss(inputs, outputs, var_list):
+        seen.append((np.shares_memory(inputs, X), len(inputs)))
+        return linear_mse(inputs, outputs, var_list)
+    opt = boomdiff.optimize.GD(learning_rate=0.1)
+    opt.minimize(loss, list(AD.from_array(np.zeros(3), 'c')), inputs=X, outputs=y, batch_size=50, seed=1)
+    assert all(view for view, _ in seen) and sorted(size for _, size in seen) == [3, 50, 50]
+    # Same seed, same batches
+    runs = []
+    for _ in range(2):
+        var_list = list(AD.from_array(np.zeros(3), 'd'))
+        boomdiff.optimize.GD(learning_rate=0.1).minimize(logistic_cross_entropy, var_list, inputs=X,
+                                                          outputs=(y > 0).astype(int), batch_size=7,
+                                                          shuffle='rows', seed=5, learning_rates=np.full(15, 0.1))
+        runs.append(AD.to_array(var_list))
+    assert np.array_equal(runs[0], runs[1])
+    with pytest.raises(AssertionError):
+        opt.minimize(linear_mse, var_list, inputs=X, outputs=y[:-1])
+    with pytest.raises(AssertionError):
+        opt.minimize(linear_mse, var_list, inputs=X, outputs=y, batch_size=10, learning_rates=[0.1, 0.2])
+
+def test_minibatch_modes():
+    from boomdiff.loss_function import linear_mse
+    rng = np.random.RandomState(3)
+    X = rng.normal(size=(103, 3))
+    beta = np.array([1., -2., 0.5])
+    y = X @ beta
+    var_list = list(AD.from_array(np.zeros(3), 'e'))
+    opt = boomdiff.optimize.GD(learning_rate=0.05)
+    opt.minimize(linear_mse, var_list, inputs=X, outputs=y, batch_size=10, seed=0, epochs=30, mode='reverse')
+    assert np.allclose(AD.to_array(var_list), beta, atol=0.05)
+    # Steps follow from epochs and batch_size, and batches are not traced
+    with pytest.raises(AssertionError):
+        opt.minimize(linear_mse, var_list, steps=5, inputs=X, outputs=y, batch_size=10)
+    with pytest.raises(AssertionError):
+        opt.minimize(linear_mse, var_list, inputs=X, outputs=y, batch_size=10, mode='trace')
@@ -0,0 +1,97 @@
+import boomdiff
+from boomdiff import AD
+from boomdiff.adarray import ADArray
+from boomdiff.reduction import reduce
+from boomdiff.trace import trace
+import functools
+import operator
+import pytest
+import numpy as np
+from tests.conftest import assert_close
+
+@pytest.fixture
+def M():
+    return AD.from_array(np.array([[0.5, -1.0, 2.0], [1.5, 0.3, -0.7]]), 'm')
+
+def test_sum_and_prod_match_fold(M):
+    f = M * M - 3
+    assert AD.sum(f) == functools.reduce(operator.add, f.ravel())
+    assert_close(AD.prod(f.ravel()), functools.reduce(operator.mul, f.ravel()))
+    for axis in [0, 1, -1]:
+        for result, expected in zip(AD.sum(f, axis=axis), np.sum(f, axis=axis)):
+            assert result == expected
+        for result, expected in zip(AD.mean(f, axis=axis), np.mean(f, axis=axis)):
+            assert result == expected
+        for result, expected in zip(AD.prod(f, axis=axis), np.prod(f, axis=axis)):
+            assert_close(result, expected)
+    # Constants mixed in, and arrays without AD instances
+    assert AD.sum([M[0, 0], 2., M[1, 1]]) == M[0, 0] + 2. + M[1, 1]
+    assert AD.sum(np.array([1., 2.])) == 3.
+    assert AD.prod([2, 3]) == 6
+    with pytest.raises(AssertionError):
+        AD.sum(M, axis=2)
+
+def test_max_min_norm_logsumexp(M):
+    flat = M.ravel()
+    assert AD.max(M) == M[0, 2]
+    assert AD.min(M) == M[0, 1]
+    assert list(AD.max(M, axis=0)) == [M[1, 0], M[1, 1], M[0, 2]]
+    assert list(AD.min(M, axis=1)) == [M[0, 1], M[1, 2]]
+    assert_close(AD.norm(flat), AD.sqrt(np.sum(flat * flat)))
+    for i, row in enumerate(M):
+        assert_close(AD.norm(M, axis=1)[i], AD.sqrt(np.sum(row * row)))
+        assert_close(AD.logsumexp(M, axis=1)[i], AD.log(np.sum(AD.exp(row))))
+    assert_close(AD.logsumexp(flat), AD.log(np.sum(AD.exp(flat))))
+    # No overflow for large values
+    big = AD.logsumexp(flat + 1000.)
+    assert np.isclose(big.func_val, AD.logsumexp(flat).func_val + 1000.)
+    assert np.isclose(sum(big.partial_dict.values()), 1.)
+    # Subgradient 0 at the origin
+    assert AD.norm(AD.from_array(np.zeros(2), 'z')) == AD(0., {'z_0': 0., 'z_1': 0.})
+
+def test_linear_key_updates():
+    # Each element depends on its own variable: the sum touches every key once
+    w = AD.from_array(np.arange(2000.), 'lin')
+    f = AD.sum(w * w)
+    assert len(f.partial_dict) == 2000
+    assert f.partial_dict['lin_1999'] == 2 * 1999.
+
+def test_indexed_and_reverse(M):
+    values = np.array([[0.5, -1.0], [2.0, 1.5]])
+    plain = AD.from_array(values, 'ri')
+    indexed = AD.from_array(values, 'ri', indexed=True)
+    for kind in ['sum', 'mean', 'prod', 'norm', 'logsumexp', 'max']:
+        result = reduce(kind, indexed * indexed)
+        assert isinstance(result.partial_dict, boomdiff.registry.Partials)
+        assert_close(result, reduce(kind, plain * plain))
+        # Reverse mode records the reduction as a single node
+        f = boomdiff.reverse.value_and_grad(lambda: reduce(kind, plain * plain))
+        assert_close(f, reduce(kind, plain * plain))
+
+def test_traced_reductions(M):
+    for fn in [AD.sum, AD.mean, AD.prod, AD.max, AD.min, AD.norm, AD.logsumexp]:
+        loss = lambda: AD.sum(fn(M * M, axis=0)) + fn(M)
+        assert_close(trace(loss).value_and_grad(), loss())
+
+def test_batched():
+    x = AD(np.array([1., 2.]), 'x')
+    y = AD(np.array([3., 4.]), 'y')
+    assert AD.sum([x, y, x]) == x + y + x
+    assert AD.prod([x, y]) == x * y
+    assert AD.norm([x, y]) == AD.sqrt(x*x + y*y)
+    with pytest.raises(ValueError):
+        AD.max([x, y])
+
+def test_adarray_matches_objects(M):
+    dense = ADArray.from_ad(M)
+    sparse = ADArray.from_ad(M, sparse=True)
+    for kind in ['prod', 'max', 'min', 'norm', 'logsumexp']:
+        assert_close(getattr(dense, kind)(), reduce(kind, M))
+        assert_close(getattr(sparse, kind)(), reduce(kind, M))
+        for axis in [0, 1]:
+            expected = reduce(kind, M, axis=axis)
+            for a in [getattr(dense, kind)(axis), getattr(sparse, kind)(axis=axis)]:
+                for i in range(len(expected)):
+                    assert_close(a[i], expected[i])
+    assert_close(np.max(dense, axis=1)[0], M[0, 2])
+    assert_close(np.prod(sparse), AD.prod(M))
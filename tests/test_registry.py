@@ -0,0 +1,92 @@
+import boomdiff
+from boomdiff import AD
+from boomdiff.registry import VariableRegistry, Partials, default_registry
+import pytest
+import numpy as np
+from tests.conftest import assert_close
+
+def test_registry_slots():
+    reg = VariableRegistry()
+    assert reg.slot('a') == 0
+    assert reg.slot('b') == 1
+    assert reg.slot('a') == 0
+    assert len(reg) == 2
+    assert 'b' in reg and 'c' not in reg
+    assert list(reg.slots(['b', 'c'])) == [1, 2]
+    assert reg.names(np.array([2, 0])) == ['c', 'a']
+    with pytest.raises(KeyError):
+        reg.lookup('d')
+
+def test_partials_dict_view():
+    p = Partials.from_dict({'pv_b': 2., 'pv_a': 1.})
+    assert len(p) == 2
+    assert p['pv_a'] == 1.
+    assert p.get('pv_c', 0) == 0
+    assert set(p.keys()) == {'pv_a', 'pv_b'}
+    assert dict(p.items()) == {'pv_a': 1., 'pv_b': 2.}
+    assert p == {'pv_a': 1., 'pv_b': 2.}
+    assert p != {'pv_a': 1.}
+    assert isinstance(p.copy(), dict)
+    with pytest.raises(KeyError):
+        p['never_registered_name']
+    # Slots are kept sorted
+    assert np.all(np.diff(p.idx) > 0)
+
+def test_partials_combine():
+    p = Partials.from_dict({'pc_a': 1., 'pc_b': 2.})
+    q = Partials.from_dict({'pc_b': 1., 'pc_c': -1.})
+    assert Partials.combine(p, 2., q, 3.) == {'pc_a': 2., 'pc_b': 7., 'pc_c': -3.}
+    assert Partials.combine(p, 1., {'pc_a': 1.}, -1.) == {'pc_a': 0., 'pc_b': 2.}
+    assert p.scale(-2) == {'pc_a': -2., 'pc_b': -4.}
+
+def test_indexed_ad_matches_dict():
+    values = np.array([[0.5, -1.0], [2.0, 0.3]])
+    plain = AD.from_array(values, 'iw')
+    indexed = AD.from_array(values, 'iw', indexed=True)
+    assert isinstance(indexed[0, 0].partial_dict, Partials)
+
+    def f(w):
+        s = AD.sum(w * np.array([[1., 2.], [3., 4.]]))
+        return (s - w[0, 1]) * w[1, 0] + 3 - 2*s + (-w[1, 1]) - (1 - s)
+
+    expected, result = f(plain), f(indexed)
+    assert isinstance(result.partial_dict, Partials)
+    assert result.func_val == expected.func_val
+    assert set(result.partial_dict.keys()) == set(expected.partial_dict.keys())
+    for k, v in expected.partial_dict.items():
+        assert np.isclose(result.partial_dict[k], v)
+
+def test_indexed_mixed_and_fallback():
+    x = AD(2.0, Partials.seed('mx'))
+    y = AD(3.0, 'my')
+    f = x * y
+    assert isinstance(f.partial_dict, Partials)
+    assert f == AD(6.0, {'mx': 3.0, 'my': 2.0})
+    g = AD.sin(x) / y
+    assert isinstance(g.partial_dict, Partials)
+    assert np.isclose(g.partial_dict['mx'], np.cos(2.0) / 3.0)
+    assert np.isclose(g.partial_dict['my'], -np.sin(2.0) / 9.0)
+    # Optimizers read the gradient through the dict view
+    opt = boomdiff.optimize.GD(learning_rate=0.1)
+    opt.minimize(lambda: (x - 1) * (x - 1), [x], steps=200)
+    assert np.isclose(x.func_val, 1.0)
+
+def test_indexed_quotient_power_and_functions():
+    values = np.array([0.4, 0.7])
+    plain = AD.from_array(values, 'qf')
+    indexed = AD.from_array(values, 'qf', indexed=True)
+
+    def f(v):
+        a, b = v
+        return (a / b + 2 / a - b / 3 + a**b + 2**a + b**2 + AD.log(a, 2) + AD.sqrt(b)
+                + AD.sin(a) + AD.cos(b) + AD.tan(a) + AD.arcsin(b) + AD.arccos(a) + AD.arctan(b)
+                + AD.sinh(a) + AD.cosh(b) + AD.tanh(a))
+
+    expected, result = f(plain), f(indexed)
+    assert isinstance(result.partial_dict, Partials)
+    assert_close(result, expected)
+
+def test_indexed_reverse_mode():
+    w = AD.from_array(np.array([1., 2.]), 'rw', indexed=True)
+    f = boomdiff.reverse.value_and_grad(lambda: w[0] * w[1] + w[0])
+    assert f.partial_dict == {'rw_0': 3., 'rw_1': 1.}
@@ -0,0 +1,56 @@
+import boomdiff
+from boomdiff import AD
+from boomdiff.reverse import Tape, value_and_grad
+import pytest
+import numpy as np
+
+def test_matches_forward():
+    x = AD(0.7, 'x')
+    y = AD(1.3, 'y')
+    loss = lambda: AD.sin(x*y)**2 + AD.log(y)/x - 3**x + AD.logistic(x - y)
+    forward = loss()
+    reverse = value_and_grad(loss)
+    assert reverse.func_val == forward.func_val
+    assert reverse.partial_dict.keys() == forward.partial_dict.keys()
+    for k in forward.partial_dict:
+        assert np.isclose(reverse.partial_dict[k], forward.partial_dict[k])
+
+def test_array_loss():
+    w = AD.from_array(np.array([0.5, -1.0, 2.0]), 'w')
+    X = np.array([[1., 2., 3.], [4., 5., 6.]])
+    loss = lambda: AD.sum((AD.dot(X, w) - 1)**2)
+    forward = loss()
+    reverse = value_and_grad(loss)
+    assert reverse.func_val == forward.func_val
+    for k in forward.partial_dict:
+        assert np.isclose(reverse.partial_dict[k], forward.partial_dict[k])
+
+def test_seeds_and_constants():
+    # Variables with non-unit seeds and multiple keys are chained like forward mode
+    x = AD(2., {'a': 2., 'b': -1.})
+    f = value_and_grad(lambda: 3*x + 1)
+    assert f.partial_dict == {'a': 6., 'b': -3.}
+    # A loss that is a bare variable
+    assert value_and_grad(lambda: x).partial_dict == {'a': 2., 'b': -1.}
+
+def test_tape_restores_state():
+    x = AD(1., 'x')
+    with Tape() as tape:
+        y = x * 2
+    assert AD._tape is None
+    assert len(tape) == 1
+    # Results created outside the tape are forward mode again
+    assert (x * 2).partial_dict == {'x': 2.}
+    with pytest.raises(AssertionError):
+        tape.gradient(3.)
+
+def test_optimizer_reverse_mode():
+    a = AD(3., 'a')
+    b = AD(-2., 'b')
+    loss = lambda: (a - 1)**2 + (b + 1)**2
+    opt = boomdiff.optimize.Adam(learning_rate=0.1)
+    opt.minimize(loss, [a, b], steps=300, mode='reverse')
+    assert np.isclose(a.func_val, 1., atol=1e-3)
+    assert np.isclose(b.func_val, -1., atol=1e-3)
+    with pytest.raises(AssertionError):
+        opt.step(loss, [a, b], mode='sideways')
@@ -0,0 +1,124 @@
+import boomdiff
+from boomdiff import AD
+from boomdiff.adarray import ADArray
+from boomdiff.trace import Program, trace
+import pytest
+import numpy as np
+from tests.conftest import assert_close
+
+def assert_matches(replayed, forward):
+    assert np.isclose(replayed.func_val, forward.func_val)
+    assert replayed.partial_dict.keys() == forward.partial_dict.keys()
+    for k in forward.partial_dict:
+        assert np.isclose(replayed.partial_dict[k], forward.partial_dict[k])
+
+def test_matches_forward():
+    x = AD(0.7, 'x')
+    y = AD(0.3, 'y')
+    loss = lambda: (AD.sin(x*y)**2 + AD.log(y, 2)/x - 3**x + AD.logistic(x - y) + x**y
+                    + AD.cos(x) * AD.tan(y) + AD.arcsin(y) - AD.arccos(y) + AD.arctan(x)
+                    + AD.sqrt(x) / (1 - y) + AD.sinh(x) - AD.cosh(y) * AD.tanh(x) + (-y) - 2/x)
+    program = trace(loss)
+    assert_matches(program.value_and_grad(), loss())
+    # Replay follows the variables as they change
+    for value in [0.1, 0.5, 0.9]:
+        x.func_val = value
+        assert_matches(program.value_and_grad(), loss())
+        assert np.isclose(program.value(), loss().func_val)
+
+def test_array_and_loss_functions():
+    X = np.array([[1., 2.], [3., 4.], [5., 6.]])
+    y = np.array([0, 1, 1])
+    w = AD.from_array(np.array([0.1, -0.2]), 'w')
+    for loss in [lambda: boomdiff.loss_function.linear_mse(X, y, w),
+                 lambda: boomdiff.loss_function.logistic_cross_entropy(X, y, w),
+                 lambda: AD.mean((AD.dot(X, w) - y)**2)]:
+        assert_matches(trace(loss).value_and_grad(), loss())
+
+def test_constants_and_leaves():
+    # A variable with a non-unit seed, and a loss that is a bare variable
+    x = AD(2., {'a': 2., 'b': -1.})
+    assert_matches(trace(lambda: 3*x + 1).value_and_grad(), 3*x + 1)
+    assert trace(lambda: x).value_and_grad() == x
+    assert len(trace(lambda: x)) == 0
+
+def test_untraceable_and_restored():
+    x = AD(1., 'x')
+    add, sin = AD.__dict__['__add__'], AD.__dict__['sin']
+    w = ADArray.from_array([1., 2.], 'w')
+    with pytest.raises(ValueError, match='cannot be traced'):
+        trace(lambda: AD.sum(w**2))
+    with pytest.raises(ValueError):
+        trace(lambda: AD(np.array([1., 2.]), 'b') * x)
+    with pytest.raises(AssertionError):
+        trace(lambda: 3.)
+    with pytest.raises(ZeroDivisionError):
+        trace(lambda: x * trace(lambda: x / 0).value())
+    # AD is left unchanged after tracing, also after an error
+    assert AD._tape is None
+    assert AD.__dict__['__add__'] is add and AD.__dict__['sin'] is sin
+    assert (x + 1).partial_dict == {'x': 1}
+
+def test_created_leaves_and_nesting():
+    # Instances created with AD() inside the loss keep the value and the
+    # derivatives they had when traced
+    x = AD(1., 'x')
+    program = trace(lambda: x * AD(2., 'c') + AD(3., {'x': 1.}))
+    x.func_val = 4.
+    assert_matches(program.value_and_grad(), x * AD(2., 'c') + AD(3., {'x': 1.}))
+    # A trace inside a trace and a trace inside a reverse mode tape
+    loss = lambda: x * trace(lambda: x**2).value()
+    assert_matches(trace(loss).value_and_grad(), loss())
+    assert_matches(boomdiff.reverse.value_and_grad(lambda: trace(lambda: x**3).value_and_grad() * x), x**4)
+
+def test_grouped_replay():
+    # Operations of the same kind and depth are replayed together
+    x = AD.from_array(np.linspace(0.1, 0.9, 50), 'x')
+    loss = lambda: AD.sum(AD.sin(x) * x + x**2)
+    program = trace(loss)
+    assert len(program) == 5 * 50 - 1
+    assert len(program._groups) < 60
+    assert_matches(program.value_and_grad(), loss())
+
+def test_max_min_replay():
+    # The selected element and the logsumexp shift follow the current values
+    x = AD(2., 'x')
+    y = AD(1., 'y')
+    extremes = trace(lambda: AD.max([x, y]) * AD.min([x, 3.]))
+    shifted = trace(lambda: AD.logsumexp([x, y]))
+    for value in [2., 5., -10., 1000.]:
+        x.func_val = value
+        for program, forward in [(extremes, AD.max([x, y]) * AD.min([x, 3.])), (shifted, AD.logsumexp([x, y]))]:
+            # The replay also lists the variable that was not selected
+            assert_close(program.value_and_grad(), forward)
+
+def test_retrace():
+    x = AD(2., 'x')
+    scale = [1.]
+    program = trace(lambda: scale[0] * x**2)
+    scale[0] = 3.
+    assert program.value() == 4.
+    program.retrace()
+    assert program.value() == 12.
+
+def test_optimizer_trace_mode():
+    a = AD(3., 'a')
+    b = AD(-2., 'b')
+    loss = lambda: (a - 1)**2 + (b + 1)**2
+    opt = boomdiff.optimize.Adam(learning_rate=0.1)
+    opt.minimize(loss, [a, b], steps=300, mode='trace')
+    assert np.isclose(a.func_val, 1., atol=1e-3)
+    assert np.isclose(b.func_val, -1., atol=1e-3)
+    # The program is traced once per loss callable
+    program = opt._program
+    opt.step(loss, [a, b], mode='trace')
+    assert opt._program is program
+    opt.retrace()
+    opt.step(loss, [a, b], mode='trace')
+    assert opt._program is not program
+
+    # Same path as forward mode
+    x_fwd, x_tr = AD(5., 'x'), AD(5., 'x')
+    for x, mode in [(x_fwd, 'forward'), (x_tr, 'trace')]:
+        boomdiff.optimize.Momentum(learning_rate=0.05).minimize(lambda: AD.sin(x) + x**2 / 10, [x], steps=50, mode=mode)
+    assert np.isclose(x_fwd.func_val, x_tr.func_val)
@@ -2,6 +2,8 @@ import boomdiff
 from boomdiff import AD
 import doctest
 import pytest
+import numpy as np
+from tests.conftest import assert_close
 
 ## Test suite for boomdiff
 
@@ -129,6 +131,321 @@ def test_evaluate():
     assert f.evaluate() == (18.0, {'x': 2.0, 'y': 2.0})
 
 
+def test_slots():
+    # AD instances have a fixed layout without a per-instance __dict__
+    x = AD(1.0, 'x')
+    assert not hasattr(x, '__dict__')
+    with pytest.raises(AttributeError):
+        x.other_attribute = 1
+
+def test_internal_constructor():
+    # Operation results skip validation but are equal to validated instances
+    x = AD(2.0, 'x')
+    assert AD._new(2.0, {'x': 1.}) == x
+    assert x * 3 == AD(6.0, {'x': 3.})
+    with boomdiff.reverse.Tape() as tape:
+        y = AD._new(1.0, {'x': 2.})
+    assert len(tape) == 1 and y.partial_dict != {'x': 2.}
+
+def test_inplace_matches_binary_operators():
+    x = AD(2.0, 'x')
+    y = AD(3.0, {'x': 1., 'y': 1.})
+    for op, iop in [(AD.__add__, AD.__iadd__), (AD.__sub__, AD.__isub__),
+                    (AD.__mul__, AD.__imul__), (AD.__truediv__, AD.__itruediv__)]:
+        for other in [y, 4.0, x]:
+            expected = op(x * 1.5, other)
+            f = x * 1.5
+            g = iop(f, other)
+            assert g is not f and g == expected and f == x * 1.5
+            # Later updates write to the result of the first one
+            assert iop(g, other) is g
+
+def test_inplace_keeps_variables():
+    # Variables are never updated in place
+    v = AD.from_array(np.array([1., 2.]), 'v', indexed=True)
+    s = v[0]
+    s += v[1]
+    s *= 2.
+    assert v[0] == AD(1., 'v_0') and s == AD(6., {'v_0': 2., 'v_1': 2.})
+
+def test_inplace_keeps_shared_storage():
+    # Constants and operands that share storage are never written to
+    y = AD(3.0, {'x': 1., 'y': 1.})
+    seed = {'x': 1.}
+    z = AD(1.0, seed)
+    w = z + 1
+    z += y
+    z *= 2
+    assert seed == {'x': 1.} and w == AD(2.0, {'x': 1.})
+    assert y == AD(3.0, {'x': 1., 'y': 1.})
+
+def test_inplace_accumulation():
+    # After the first copy, accumulation updates the same dictionary
+    x = AD(2.0, 'x')
+    total = x * 1.
+    total += AD(3.0, {'x': 1., 'y': 1.})
+    ders = total.partial_dict
+    for i in range(100):
+        total += AD(1., f'acc_{i}')
+    assert total.partial_dict is ders and len(ders) == 102
+    shared = total + 1.
+    total += x
+    assert shared.partial_dict['x'] == 2. and total.partial_dict['x'] == 3.
+
+def test_inplace_array_operand():
+    # Arrays on the right give arrays, like the binary operators
+    f = AD(2.0, 'x') * 1.
+    f += np.array([1., 2.])
+    assert isinstance(f, np.ndarray) and f[1] == AD(4.0, {'x': 1.})
+
+def test_inplace_recorded_graphs():
+    # Recorded graphs keep the old instance
+    x = AD(2.0, 'x')
+    g = boomdiff.reverse.value_and_grad(lambda: _accumulate(x))
+    assert g == _accumulate(x)
+    program = boomdiff.trace.trace(lambda: _accumulate(x))
+    assert program.value_and_grad() == _accumulate(x)
+
+def test_inplace_registry_and_batched():
+    # Registry-backed and batched derivatives
+    p = AD(2.0, boomdiff.registry.Partials.seed('px'))
+    p *= p
+    assert p == AD(4.0, {'px': 4.})
+    b = AD(np.array([1., 2.]), 'b')
+    b += b * b
+    assert np.array_equal(b.partial_dict['b'], [3., 5.])
+
+def _accumulate(x):
+    total = x * x
+    total += x
+    total *= x
+    total -= 1
+    total /= x + 1
+    return total
+
+def test_pruning_off_by_default():
+    x = AD(2.0, 'x')
+    y = AD(3.0, 'y')
+    assert AD._prune is None
+    assert (x + y - x).partial_dict == {'x': 0., 'y': 1.}
+    assert (x / x).partial_dict['x'] == 0.
+
+def test_pruning_exact_zeros():
+    x = AD(2.0, 'x')
+    y = AD(3.0, 'y')
+    previous = AD.set_pruning(0.)
+    try:
+        assert (x + y - x).partial_dict == {'y': 1.}
+        assert (x * 0. + y).partial_dict == {'y': 1.}
+        assert len((x + 1e-12 * y).partial_dict) == 2
+    finally:
+        assert AD.set_pruning(previous) == 0.
+    assert AD._prune is None
+    with pytest.raises(AssertionError):
+        AD.set_pruning(-1.)
+
+def test_pruning_threshold():
+    x = AD(2.0, 'x')
+    y = AD(3.0, 'y')
+    with AD.pruning(1e-9):
+        assert (x + 1e-12 * y).partial_dict == {'x': 1.}
+        total = x * 1.
+        total += 1e-12 * y
+        assert total.partial_dict == {'x': 1.}
+    assert AD._prune is None
+
+def test_pruning_partials_and_batched():
+    # Registry-backed derivatives are pruned too, batched ones are kept
+    y = AD(3.0, 'y')
+    with AD.pruning(0.):
+        p = AD(1.0, boomdiff.registry.Partials.seed('pp')) + y
+        assert (p - y).partial_dict == {'pp': 1.}
+        b = AD(np.array([1., 2.]), 'b')
+        assert 'b' in (b - b).partial_dict
+
+def test_missing_entries_equal_zero():
+    x = AD(2.0, 'x')
+    assert x * 0. == AD(0., {'x': 0.}) and x * 0. != AD(0., {'x': 1.})
+    with AD.pruning(0.):
+        assert x * 0. == AD(0., {'x': 0.}) and x * 0. == AD(0., {})
+
+def test_optimizer_missing_gradients():
+    x = AD(2.0, 'x')
+    y = AD(3.0, 'y')
+    opt = boomdiff.optimize.GD(learning_rate=0.1)
+    # A variable the loss does not depend on is a mistake
+    with pytest.raises(AttributeError):
+        opt.step(lambda: x * x, [x, y])
+    # unless pruning may have removed its zero derivative
+    with AD.pruning(0.):
+        opt.step(lambda: x * x + y * 0., [x, y])
+    assert x.func_val == 1.6 and y.func_val == 3.0
+
+def test_optimizer_array_elements():
+    from boomdiff.adarray import ADArray
+    # Elements of an ADArray list every name of the array; each one is
+    # updated as the variable with a nonzero seed
+    w = ADArray.from_array(np.array([1., 2.]), 'w').to_objects()
+    assert w[1].partial_dict == {'w_0': 0., 'w_1': 1.}
+    opt = boomdiff.optimize.GD(learning_rate=0.5)
+    opt.step(lambda: w[0] * w[0] + w[1], list(w))
+    assert w[0].func_val == 0. and w[1].func_val == 1.5
+
+def test_elementary_kernels():
+    from boomdiff.autodiff import _ELEMENTARY
+    from boomdiff.adarray import ADArray
+    x = AD(0.3, 'x') * AD(0.5, 'y')
+    packed = ADArray.from_ad([x])
+    p = AD(0.3, boomdiff.registry.Partials.seed('kx'))
+    for name, (value_fn, der_fn) in _ELEMENTARY.items():
+        f = getattr(AD, name)(x)
+        der = der_fn(x.func_val, value_fn(x.func_val))
+        assert f == AD(value_fn(0.15), {'x': 0.5 * der, 'y': 0.3 * der})
+        assert getattr(AD, name)(packed)[0] == f
+        assert getattr(AD, name)(p) == AD(value_fn(0.3), {'kx': der_fn(0.3, value_fn(0.3))})
+
+def test_elementary_new_entry():
+    from boomdiff.autodiff import _ELEMENTARY
+    # A new table entry gets the same chain rule
+    _ELEMENTARY['cube'] = (lambda a: a**3, lambda a, value: 3*a**2)
+    try:
+        assert AD._elementary('cube', AD(2., 'x')) == AD(8., {'x': 12.})
+        assert AD._elementary('cube', 2.) == 8.
+    finally:
+        del _ELEMENTARY['cube']
+
+def test_fused_match_composed():
+    # Fused operations agree with their composed definitions
+    x = AD(0.3, 'x') * AD(0.5, 'y')
+    assert_close(AD.logistic(x, x_0=0.2, k=3., L=2.), 2. / (1 + AD.exp(-3. * (x - 0.2))))
+    assert_close(AD.log1p(x), AD.log(1 + x))
+    assert_close(AD.expm1(x), AD.exp(x) - 1)
+    assert_close(AD.softplus(x), AD.log(1 + AD.exp(x)))
+    assert_close(AD.log_sigmoid(x), AD.log(AD.logistic(x)))
+    assert_close(AD.bce_with_logits(x, 0.7), -(0.7 * AD.log(AD.logistic(x)) + 0.3 * AD.log(1 - AD.logistic(x))))
+
+def test_fused_large_logits():
+    # Finite values and derivatives for large logits
+    for z in [-1000., 1000.]:
+        for f in [AD.logistic(AD(z, 'z')), AD.softplus(AD(z, 'z')), AD.log_sigmoid(AD(z, 'z')),
+                  AD.bce_with_logits(AD(z, 'z'), 1.)]:
+            assert np.isfinite(f.func_val) and np.isfinite(f.partial_dict.get('z', 0))
+    assert AD.bce_with_logits(AD(-1000., 'z'), 1.) == AD(1000., {'z': -1.})
+    assert AD.log_sigmoid(AD(-1000., 'z')) == AD(-1000., {'z': 1.})
+
+def test_fused_arrays_and_constants():
+    from boomdiff.adarray import ADArray
+    packed = ADArray.from_array([-0.5, 0.5, 40.], 'w')
+    objs = packed.to_objects()
+    for name in ['log1p', 'expm1', 'softplus', 'log_sigmoid', 'logistic']:
+        for a, b in zip(getattr(AD, name)(packed), getattr(AD, name)(objs)):
+            assert_close(a, b)
+    for a, b in zip(AD.bce_with_logits(packed, [0., 1., 1.]), AD.bce_with_logits(objs, [0., 1., 1.])):
+        assert_close(a, b)
+    assert np.isclose(AD.bce_with_logits(0., 1.), np.log(2))
+    with pytest.raises(ValueError):
+        AD.bce_with_logits(objs, [0., 1.])
+
+def test_fused_trace_and_hessian():
+    from boomdiff.hessian import hessian
+    from boomdiff.trace import trace
+    # Traced: gradients and second derivatives
+    v = AD(0.4, 'v')
+    for name in ['log1p', 'expm1', 'softplus', 'log_sigmoid']:
+        loss = lambda: getattr(AD, name)(v * v) + AD.bce_with_logits(v, 0.2)
+        assert_close(trace(loss).value_and_grad(), loss())
+        h = 1e-5
+        numeric = []
+        for dv in [h, -h]:
+            w = AD(0.4 + dv, 'v')
+            numeric.append(getattr(AD, name)(w * w).partial_dict['v'] + AD.bce_with_logits(w, 0.2).partial_dict['v'])
+        assert np.isclose(hessian(loss, [v])[0, 0], (numeric[0] - numeric[1]) / (2 * h), atol=1e-6)
+
+def test_fused_reverse_mode():
+    v = AD(0.4, 'v')
+    assert_close(boomdiff.reverse.value_and_grad(lambda: AD.softplus(v) * AD.log1p(v)), AD.softplus(v) * AD.log1p(v))
+
+def test_requires_grad_constant():
+    x = AD(2., 'x')
+    w = AD.from_array(np.array([1., 2.]), 'w', indexed=True)
+    assert x.requires_grad
+    x.requires_grad = False
+    assert x.partial_dict == {} and x.name() == ['x']
+    f = AD.sin(x) * w[0] + x * w[1]
+    assert f == AD(np.sin(2.) + 4., {'w_0': np.sin(2.), 'w_1': 2.})
+    assert 'x' not in f.partial_dict
+
+def test_requires_grad_updates():
+    # In-place operations leave the variable unchanged; assigning its value
+    # keeps it frozen
+    x = AD(2., 'x')
+    x.requires_grad = False
+    s = x
+    s += 1.
+    assert s == AD(3., {}) and x.func_val == 2.
+    x.func_val += 1.
+    assert x.func_val == 3. and not x.requires_grad
+    x.requires_grad = True
+    assert x == AD(3., {'x': 1.})
+    with pytest.raises(AssertionError):
+        x.requires_grad = 0
+
+def test_frozen_context():
+    # The context restores only the variables it froze
+    x = AD(3., 'x')
+    y = AD(1., 'y')
+    y.requires_grad = False
+    with AD.frozen(np.array([[x, y]])):
+        assert not x.requires_grad and (x * y).partial_dict == {}
+    assert x.requires_grad and not y.requires_grad
+    with pytest.raises(AssertionError):
+        with AD.frozen([x, 2.]):
+            pass
+
+def test_frozen_reverse_and_trace():
+    # Reverse mode and traces see frozen variables as constants
+    x = AD(3., 'x')
+    y = AD(1., 'y')
+    y.requires_grad = False
+    w = AD.from_array(np.array([1., 2.]), 'w', indexed=True)
+    with AD.frozen(x):
+        assert boomdiff.reverse.value_and_grad(lambda: x * w[0] + y) == AD(4., {'w_0': 3.})
+        assert boomdiff.trace.trace(lambda: x * w[0]).value_and_grad() == AD(3., {'w_0': 3.})
+
+def test_no_grad_values():
+    x = AD(0.5, 'x')
+    w = AD.from_array(np.array([1., 2.]), 'w', indexed=True)
+    loss = lambda: AD.sum(AD.logistic(w * x)) + AD.log1p(x) / x - x**2
+    with AD.no_grad():
+        f = loss()
+        assert f.partial_dict == {} and f.func_val == loss().func_val
+        # Instances created in the body are constants
+        assert AD(1., 'c').partial_dict == {}
+    # Derivatives are computed again after the context
+    assert loss().partial_dict['w_0'] != 0
+
+def test_no_grad_arrays():
+    from boomdiff.adarray import ADArray
+    w = AD.from_array(np.array([1., 2.]), 'w', indexed=True)
+    with AD.no_grad():
+        # Packed arrays and the AD.dot fast path keep values only
+        y = AD.dot(np.ones((3, 2)), w)
+        assert isinstance(y, ADArray) and y.names == [] and np.allclose(y.func_val, 3.)
+        assert ADArray.from_array([1., 2.], 'v').jacobian().shape == (2, 0)
+
+def test_no_grad_inplace():
+    # In-place operators give value-only results and leave the variables
+    w = AD.from_array(np.array([1., 2.]), 'w')
+    def loss():
+        out = w[0]
+        out += w[1] * 3.
+        return out * out
+    with AD.no_grad():
+        assert loss() == AD(49., {})
+        for iop in [AD.__iadd__, AD.__isub__, AD.__imul__, AD.__itruediv__]:
+            assert iop(w[1], 4.).partial_dict == {}
+    assert w[0] == AD(1., 'w_0') and w[1] == AD(2., 'w_1')
+
 #### MISC TESTS
 def test_improper_logbase():
     x = AD(3)